@@ -0,0 +1,42 @@
+import logging
+import os
+import statistics
+import time
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wooza.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+
+    # Empty searches answer 404, which django.request would log every run.
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    return connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+def teardown(old_name):
+    from django.db import connection
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+def timeit(func, repeat=5, setup=None):
+    timings = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+    }
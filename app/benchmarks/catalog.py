@@ -0,0 +1,54 @@
+import random
+
+OPERATORS = ['oi', 'tim', 'vivo', 'claro']
+DDD_DISTRIBUTIONS = ['uniform', 'zipf']
+
+
+def generate_plans(rows, ddd_distribution='uniform', operators=None,
+                   ddds_per_plan=(1, 5), ddds=None, seed=0):
+    from plans import lists
+    from plans.models import Plans
+
+    generator = random.Random(seed)
+    operators = operators or OPERATORS
+    plan_types = [plan_type.lower() for plan_type in lists.PLAN_TYPES_CHOICE]
+
+    # zipf skews coverage towards the first DDDs in the list, like a catalog
+    # where the big metro areas carry most of the plans.
+    if ddd_distribution == 'zipf':
+        weights = [1 / rank for rank in range(1, len(lists.DDDS_CHOICE) + 1)]
+    else:
+        weights = None
+
+    for index in range(rows):
+        plan_ddds = set(ddds or [])
+        plan_ddds.update(
+            generator.choices(lists.DDDS_CHOICE, weights, k=generator.randint(*ddds_per_plan)))
+
+        yield Plans(
+            plan_code='Bench%d' % index,
+            minutes=generator.choice([50, 100, 200, 500, 1000]),
+            internet='%dGB' % generator.randint(1, 50),
+            price='%.2f' % generator.uniform(9.9, 199.9),
+            plan_type=generator.choice(plan_types),
+            operator=generator.choice(operators),
+            ddds=sorted(plan_ddds)
+        )
+
+def load_catalog(rows, batch_size=5000, **options):
+    from django.db import connection
+    from plans.models import Plans
+
+    batch = []
+    for plan in generate_plans(rows, **options):
+        batch.append(plan)
+
+        if len(batch) == batch_size:
+            Plans.objects.bulk_create(batch)
+            batch = []
+
+    if batch:
+        Plans.objects.bulk_create(batch)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE plans_plans')
@@ -0,0 +1,75 @@
+"""
+Compares the ddds array lookups (GIN containment and overlap) with the
+ddds_low/ddds_high bitset lookups, and the storage each one takes.
+
+Run from the app/ directory:
+
+    python -m benchmarks.ddds --rows 100000
+"""
+
+import argparse
+
+from . import base
+from . import catalog
+
+QUERIES = {
+    'all_1': ([11], 'all'),
+    'all_2': ([11, 21], 'all'),
+    'any_2': ([68, 99], 'any'),
+    'any_5': ([11, 21, 31, 61, 99], 'any'),
+}
+
+
+def storage():
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT sum(pg_column_size(ddds)), '
+            'sum(pg_column_size(ddds_low) + pg_column_size(ddds_high)), '
+            "pg_relation_size('plans_ddds_gin_idx') FROM plans_plans")
+        return dict(zip(('ddds_kb', 'masks_kb', 'gin_kb'),
+                        (size // 1024 for size in cursor.fetchone())))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--distribution', choices=catalog.DDD_DISTRIBUTIONS, default='zipf')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    old_name = base.setup()
+
+    from unittest import mock
+
+    from plans import helpers
+    from plans.models import Plans
+
+    def count(ddds, match):
+        return Plans.objects.filter(helpers.ddds_lookup(ddds, match)).count()
+
+    try:
+        catalog.load_catalog(args.rows, ddd_distribution=args.distribution)
+
+        results = {}
+        for name, (ddds, match) in QUERIES.items():
+            for lookup in ('array', 'bitset'):
+                with mock.patch.object(helpers, 'DDDS_LOOKUP', lookup):
+                    results['%s_%s' % (lookup, name)] = dict(
+                        base.timeit(lambda: count(ddds, match), args.repeat),
+                        rows=count(ddds, match))
+
+        sizes = storage()
+    finally:
+        base.teardown(old_name)
+
+    for name, timing in results.items():
+        print('%-14s rows %7d  min %10.3f ms  median %10.3f ms' % (
+            name, timing['rows'], timing['min_ms'], timing['median_ms']))
+
+    print('ddds %d kB  masks %d kB  gin index %d kB' % (
+        sizes['ddds_kb'], sizes['masks_kb'], sizes['gin_kb']))
+
+
+if __name__ == '__main__':
+    main()
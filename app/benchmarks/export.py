@@ -0,0 +1,94 @@
+"""
+Measures the peak RSS growth of a worker streaming the catalog export.
+
+Each size is exported in a forked child so its peak RSS is measured on its
+own. Run from the app/ directory:
+
+    python -m benchmarks.export --rows 1000000
+"""
+
+import argparse
+import multiprocessing
+import resource
+
+from . import base
+
+
+def rss_kb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+
+def consume(path, queue):
+    from django.test import Client
+
+    start_kb = rss_kb()
+    response = Client().get(path)
+    content = response.streaming_content if response.streaming else [response.content]
+
+    size = 0
+    for chunk in content:
+        size += len(chunk)
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((size, peak_kb - start_kb))
+
+def measure(path):
+    from django.db import connections
+
+    connections.close_all()
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=consume, args=(path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--list-max-rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    old_name = base.setup()
+
+    from django.db import connection
+
+    # DDD 11 covers 1%, 12 covers 10% and 13 covers every seeded plan.
+    sizes = [(11, args.rows // 100), (12, args.rows // 10), (13, args.rows)]
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO plans_plans
+                    (plan_code, minutes, internet, price, plan_type, operator, ddds)
+                SELECT
+                    'Bench' || n, 100, '10GB', 10 + (n %% 19000) / 100.0, 'pós', 'oi',
+                    ARRAY[13]
+                    || CASE WHEN n <= %s THEN ARRAY[12] ELSE '{}'::int[] END
+                    || CASE WHEN n <= %s THEN ARRAY[11] ELSE '{}'::int[] END
+                FROM generate_series(1, %s) AS n
+                """,
+                [sizes[1][1], sizes[0][1], args.rows])
+            cursor.execute('ANALYZE plans_plans')
+
+        results = []
+        for ddd, rows in sizes:
+            for endpoint in ['/plans/export?format=ndjson&ddds=[%d]', '/plans/?ddds=[%d]']:
+                if endpoint.startswith('/plans/?') and rows > args.list_max_rows:
+                    continue
+
+                size, peak_kb = measure(endpoint % ddd)
+                results.append((endpoint.split('?')[0], rows, size, peak_kb))
+    finally:
+        base.teardown(old_name)
+
+    for endpoint, rows, size, peak_kb in results:
+        print('%-14s %9d rows %12d bytes  peak RSS +%8d KB' % (endpoint, rows, size, peak_kb))
+
+
+if __name__ == '__main__':
+    main()
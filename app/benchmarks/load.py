@@ -0,0 +1,97 @@
+"""
+Load test comparing the WSGI and ASGI deployments at a fixed concurrency.
+
+Start both servers against the same database, for example:
+
+    gunicorn wooza.wsgi --workers 1 --threads 8 --bind 127.0.0.1:8000
+    uvicorn wooza.asgi:application --workers 1 --port 8001
+
+and run from the app/ directory:
+
+    python -m benchmarks.load \
+        --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001 \
+        --path '/plans/?ddds=[11]' --concurrency 64 --requests 2000
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def percentile(timings, percent):
+    index = min(len(timings) - 1, int(round(percent / 100 * (len(timings) - 1))))
+    return sorted(timings)[index]
+
+def run(url, concurrency, requests):
+    timings = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url) as response:
+                    response.read()
+            except urllib.error.HTTPError as error:
+                # The list answers 404 when nothing matches, which is still
+                # a complete response.
+                error.read()
+                if error.code >= 500:
+                    errors.append(error.code)
+            except OSError as error:
+                errors.append(str(error))
+
+            with lock:
+                timings.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(timings),
+        'errors': len(errors),
+        'rps': round(len(timings) / elapsed, 2),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--target', action='append', required=True,
+        help='name=base_url, may be given several times')
+    parser.add_argument('--path', default='/plans/?ddds=[11]')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    path = urllib.parse.quote(args.path, safe='/?&=')
+
+    for target in args.target:
+        name, base_url = target.split('=', 1)
+        result = run(base_url.rstrip('/') + path, args.concurrency, args.requests)
+
+        print('%-6s %6d req  %4d err  %9.2f req/s  p50 %9.3f ms  p99 %9.3f ms' % (
+            name, result['requests'], result['errors'], result['rps'],
+            result['p50_ms'], result['p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares the unpaginated list fetch against keyset pages 1 and N.
+
+Run from the app/ directory:
+
+    python -m benchmarks.pagination --rows 100000 --limit 50 --page 1000
+"""
+
+import argparse
+
+from . import base
+from . import catalog
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--page', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    old_name = base.setup()
+
+    from django.core.cache import cache
+    from django.test import Client
+
+    from plans import helpers
+    from plans.models import Plans
+
+    try:
+        catalog.load_catalog(args.rows, ddds=[11])
+        client = Client()
+        path = '/plans/?ddds=[11]'
+
+        offset = (args.page - 1) * args.limit - 1
+        last_of_previous = Plans.objects.filter(
+            ddds__contains=[11]).order_by('price', 'id')[offset]
+        cursor = helpers.encode_cursor('price', last_of_previous.price, last_of_previous.id)
+
+        results = {
+            'full_fetch': base.timeit(
+                lambda: client.get(path), args.repeat, setup=cache.clear),
+            'page_1': base.timeit(
+                lambda: client.get('%s&limit=%d' % (path, args.limit)), args.repeat,
+                setup=cache.clear),
+            'page_%d' % args.page: base.timeit(
+                lambda: client.get('%s&limit=%d&cursor=%s' % (path, args.limit, cursor)),
+                args.repeat, setup=cache.clear),
+        }
+    finally:
+        base.teardown(old_name)
+
+    for name, timing in results.items():
+        print('%-12s min %10.3f ms  median %10.3f ms' % (
+            name, timing['min_ms'], timing['median_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares the CPU time of building a list response from model instances
+with the values_list row path, per 10k rows.
+
+Run from the app/ directory:
+
+    python -m benchmarks.serialization --rows 10000
+"""
+
+import argparse
+import time
+
+from . import base
+from . import catalog
+
+
+def cpu_ms(func, repeat):
+    timings = []
+
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        timings.append((time.process_time() - start) * 1000)
+
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    old_name = base.setup()
+
+    from django.http import JsonResponse
+
+    from plans import helpers
+    from plans.models import Plans
+
+    def models_path():
+        payload = []
+        for plan in Plans.objects.all():
+            payload.append(
+                {
+                    'id': plan.id,
+                    'plan_code': plan.plan_code,
+                    'minutes': plan.minutes,
+                    'internet': plan.internet,
+                    'price': plan.price,
+                    'plan_type': plan.plan_type,
+                    'operator': plan.operator,
+                    'ddds': plan.ddds
+                }
+            )
+        JsonResponse({'data': payload, 'total': len(payload), 'status_code': 200})
+
+    def rows_path(dumps):
+        def run():
+            rows = Plans.objects.values_list(*helpers.PLAN_FIELDS)
+            payload = [helpers.serialize_row(row) for row in rows]
+            helpers.json_dumps(
+                {'data': payload, 'total': len(payload), 'status_code': 200}, dumps)
+        return run
+
+    try:
+        catalog.load_catalog(args.rows)
+
+        results = {
+            'models + DjangoJSONEncoder': cpu_ms(models_path, args.repeat),
+            'values_list + json.dumps': cpu_ms(rows_path(helpers.get_json_dumps()), args.repeat),
+        }
+
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            results['values_list + orjson.dumps'] = cpu_ms(rows_path(orjson.dumps), args.repeat)
+    finally:
+        base.teardown(old_name)
+
+    baseline = results['models + DjangoJSONEncoder']
+    for name, cpu in results.items():
+        per_10k = cpu * 10000 / args.rows
+        print('%-28s %9.3f ms CPU per 10k rows  (saves %8.3f ms)' % (
+            name, per_10k, (baseline - cpu) * 10000 / args.rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Repeatable benchmarks for the plans API hot paths.
+
+Run from the app/ directory:
+
+    python -m benchmarks.suite --rows 20000 --output results.json
+
+Pass a previous results file as --baseline to fail (exit status 1) when a
+benchmark's median is slower than the baseline by more than --threshold:
+
+    python -m benchmarks.suite --baseline results.json --threshold 0.2
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import random
+import sys
+
+from . import base
+from . import catalog
+
+LIST_FILTERS = {
+    'list_unfiltered': '',
+    'list_ddds': 'ddds=[11]',
+    'list_ddds_plan_type': 'ddds=[11]&plan_type=Controle',
+    'list_ddds_operator': 'ddds=[11]&operator=oi',
+    'list_ddds_plan_code': 'ddds=[11]&plan_code=Bench10',
+    'list_all_filters': 'ddds=[11]&plan_type=Controle&operator=oi&plan_code=Bench10',
+    'list_ddds_paginated': 'ddds=[11]&limit=50',
+}
+
+PAYLOAD = {
+    'minutes': 100,
+    'internet': '10GB',
+    'price': '29.75',
+    'plan_type': 'Pós',
+    'operator': 'Oi',
+    'ddds': [11, 21]
+}
+
+
+def run_benchmarks(args):
+    from django.core.cache import cache
+    from django.test import Client
+
+    from plans import helpers
+    from plans.models import Plans
+
+    client = Client()
+    generator = random.Random(args.seed)
+    counter = itertools.count()
+    plan_ids = [plan_id for plan_id in Plans.objects.values_list('id', flat=True)]
+    results = {}
+
+    # Every list run starts from an empty cache so the query and the
+    # serialisation are measured, not a cache hit.
+    for name, querystring in LIST_FILTERS.items():
+        results[name] = base.timeit(
+            lambda: client.get('/plans/?' + querystring), args.repeat, setup=cache.clear)
+
+    def create():
+        payload = dict(PAYLOAD, plan_code='Create%d' % next(counter))
+        client.post('/plans/create/', data=payload, content_type='application/json')
+
+    def update():
+        payload = {'price': '%.2f' % generator.uniform(9.9, 199.9)}
+        client.put(
+            '/plans/update/%d' % generator.choice(plan_ids), data=payload,
+            content_type='application/json')
+
+    deleted = []
+
+    def create_for_delete():
+        plan = helpers.build_plan(dict(PAYLOAD, plan_code='Delete%d' % next(counter)))
+        plan.save()
+        deleted.append(plan.id)
+
+    def delete():
+        client.post('/plans/delete/%d' % deleted[-1])
+
+    results['create'] = base.timeit(create, args.repeat)
+    results['update'] = base.timeit(update, args.repeat)
+    results['delete'] = base.timeit(delete, args.repeat, setup=create_for_delete)
+
+    payload = dict(PAYLOAD, plan_code='Validate')
+
+    def validates_payload():
+        for _ in range(1000):
+            helpers.validates_payload(payload)
+
+    results['validates_payload_x1000'] = base.timeit(validates_payload, args.repeat)
+
+    rows = [row for row in Plans.objects.values_list(*helpers.PLAN_FIELDS)[:1000]]
+
+    def build_response():
+        payload = [helpers.serialize_row(row) for row in rows]
+        helpers.json_response({'data': payload, 'total': len(payload), 'status_code': 200})
+
+    results['response_1000_plans'] = base.timeit(build_response, args.repeat)
+
+    return results
+
+def compare(results, baseline, threshold):
+    regressions = []
+
+    for name, timing in results.items():
+        if name not in baseline:
+            continue
+
+        baseline_ms = baseline[name]['median_ms']
+        if timing['median_ms'] > baseline_ms * (1 + threshold):
+            regressions.append((name, baseline_ms, timing['median_ms']))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--ddd-distribution', choices=catalog.DDD_DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--operators', default=','.join(catalog.OPERATORS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    old_name = base.setup()
+
+    import django
+
+    try:
+        catalog.load_catalog(
+            args.rows, ddd_distribution=args.ddd_distribution,
+            operators=args.operators.split(','), ddds=[11], seed=args.seed)
+        results = run_benchmarks(args)
+    finally:
+        base.teardown(old_name)
+
+    for name, timing in results.items():
+        print('%-26s min %10.3f ms  median %10.3f ms' % (
+            name, timing['min_ms'], timing['median_ms']))
+
+    if args.output:
+        report = {
+            'meta': {
+                'rows': args.rows,
+                'ddd_distribution': args.ddd_distribution,
+                'operators': args.operators.split(','),
+                'repeat': args.repeat,
+                'seed': args.seed,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'created_at': datetime.datetime.utcnow().isoformat(),
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.threshold)
+
+        for name, baseline_ms, median_ms in regressions:
+            print('REGRESSION %s: %.3f ms -> %.3f ms' % (name, baseline_ms, median_ms))
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares the list-scan payload validation helpers used to have with the
+compiled PayloadValidator, one payload at a time and as a batch.
+
+Run from the app/ directory:
+
+    python -m benchmarks.validation --payloads 10000
+"""
+
+import argparse
+import os
+import random
+
+import django
+
+from . import base
+
+
+def legacy_validates_required_fields(payload, required_fields):
+    return [{key: 'is required.'} for key in required_fields if key not in payload]
+
+def legacy_validates_payload(payload, lists):
+    invalid_fields = []
+
+    for key in payload:
+        if not payload[key]:
+            invalid_fields.append({key: 'is empty.'})
+
+    if invalid_fields:
+        return invalid_fields
+
+    try:
+        int(payload['minutes'])
+    except ValueError:
+        invalid_fields.append({'minutes': 'is not a valid number.'})
+
+    try:
+        float(payload['price'])
+    except ValueError:
+        invalid_fields.append({'price': 'is not a valid number.'})
+
+    if payload['plan_type'] not in lists.PLAN_TYPES_CHOICE:
+        invalid_fields.append({'plan_type': 'is not a valid choice.'})
+
+    for ddd in payload['ddds']:
+        if ddd not in lists.DDDS_CHOICE:
+            invalid_fields.append({'ddds': 'is not a valid choice.'})
+
+    return invalid_fields
+
+def generate_payloads(count, lists, invalid_ratio, seed):
+    rand = random.Random(seed)
+    payloads = []
+
+    for index in range(count):
+        payload = {
+            'plan_code': 'Plan%d' % index,
+            'minutes': rand.choice([100, 200, 500]),
+            'internet': '10GB',
+            'price': round(rand.uniform(10, 200), 2),
+            'plan_type': rand.choice(lists.PLAN_TYPES_CHOICE),
+            'operator': 'oi',
+            'ddds': rand.sample(lists.DDDS_CHOICE, 5)
+        }
+
+        if rand.random() < invalid_ratio:
+            payload[rand.choice(['minutes', 'price', 'ddds'])] = rand.choice(['abc', [10, 20]])
+
+        payloads.append(payload)
+
+    return payloads
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payloads', type=int, default=10000)
+    parser.add_argument('--invalid-ratio', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wooza.settings')
+    django.setup()
+
+    from plans import helpers, lists
+
+    payloads = generate_payloads(args.payloads, lists, args.invalid_ratio, args.seed)
+
+    # The legacy helpers raise TypeError on a non-numeric list, which the
+    # compiled validator reports as an invalid field instead.
+    def legacy():
+        errors = {}
+        for index, payload in enumerate(payloads):
+            try:
+                invalid_fields = (
+                    legacy_validates_required_fields(payload, helpers.REQUIRED_FIELDS)
+                    or legacy_validates_payload(payload, lists))
+            except TypeError:
+                invalid_fields = [{'row': 'is not valid.'}]
+            if invalid_fields:
+                errors[index] = invalid_fields
+
+    def per_payload():
+        errors = {}
+        for index, payload in enumerate(payloads):
+            invalid_fields = helpers.validates_required_fields(payload) or helpers.validates_payload(payload)
+            if invalid_fields:
+                errors[index] = invalid_fields
+
+    def batch():
+        helpers.PAYLOAD_VALIDATOR.validate_batch(payloads)
+
+    results = {
+        'legacy list scans': base.timeit(legacy, args.repeat),
+        'PayloadValidator.validate': base.timeit(per_payload, args.repeat),
+        'PayloadValidator.validate_batch': base.timeit(batch, args.repeat),
+    }
+
+    for name, result in results.items():
+        print('%-32s min %9.3f ms  median %9.3f ms' % (name, result['min_ms'], result['median_ms']))
+
+
+if __name__ == '__main__':
+    main()
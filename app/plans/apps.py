@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PlansConfig(AppConfig):
     name = 'plans'
+
+    def ready(self):
+        from . import timing
+
+        connection_created.connect(timing.install)
@@ -0,0 +1,89 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from . import caching
+from . import helpers
+
+_flights = {}
+
+
+def database_sync_to_async(func):
+    # The ORM is synchronous, so database work runs in the executor threads
+    # instead of the single thread-sensitive one, letting slow queries
+    # overlap. Connections are closed the way request_finished would do it.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(wrapper, thread_sensitive=False)
+
+def insert_plan(plan):
+    inserted = helpers.insert_plan(plan)
+
+    if inserted:
+        caching.invalidate(caching.plan_buckets(plan))
+        helpers.bump_catalog_version()
+
+    return inserted
+
+def update_plan(plan_id, payload):
+    updated = helpers.update_plan(plan_id, payload)
+
+    if updated and updated[1] is not None:
+        plan, previous = updated
+        caching.invalidate(caching.plan_buckets(previous) + caching.plan_buckets(plan))
+        helpers.bump_catalog_version()
+
+    return updated
+
+def delete_plan(plan_id):
+    plan = helpers.delete_plan(plan_id)
+
+    if plan:
+        caching.invalidate(caching.plan_buckets(plan))
+        helpers.bump_catalog_version()
+
+    return plan
+
+async def load_list(key, queryset):
+    # Requests waiting on the same list query await a future on the loop, so
+    # they don't hold the executor threads the query itself needs.
+    loop = asyncio.get_running_loop()
+    flight = _flights.get((loop, key))
+
+    if flight is not None:
+        caching.count_coalesced()
+        result = await asyncio.shield(flight)
+
+        # The first request failed, so this one gets its own try.
+        if result is None:
+            return await fetch_list(key, queryset)
+
+        return result
+
+    flight = _flights[(loop, key)] = loop.create_future()
+    try:
+        result = await fetch_list(key, queryset)
+    except BaseException:
+        flight.set_result(None)
+        raise
+    finally:
+        del _flights[(loop, key)]
+
+    flight.set_result(result)
+    return result
+
+list_versions = database_sync_to_async(caching.list_versions)
+fetch_list = database_sync_to_async(caching.load_list)
+insert_plan = database_sync_to_async(insert_plan)
+update_plan = database_sync_to_async(update_plan)
+delete_plan = database_sync_to_async(delete_plan)
+
+get_cached = sync_to_async(caching.get_cached, thread_sensitive=False)
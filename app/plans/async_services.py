@@ -0,0 +1,125 @@
+import json
+
+from django.db import IntegrityError
+from django.http import HttpResponse, HttpResponseNotModified
+
+from . import async_helpers
+from . import caching
+from . import helpers
+
+
+def csrf_exempt(view_func):
+    # django.views.decorators.csrf.csrf_exempt wraps the view in a sync
+    # function, which would hide the coroutine from the handler.
+    view_func.csrf_exempt = True
+    return view_func
+
+@csrf_exempt
+async def create(request):
+    if not request.method == 'POST':
+        return helpers.error_response(400, 'Bad Request.')
+
+    payload = json.loads(request.body)
+
+    invalid_fields = helpers.validates_payload(payload)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    try:
+        plan = helpers.build_plan(payload)
+        inserted = await async_helpers.insert_plan(plan)
+    except Exception:
+        return helpers.error_response(500, 'Internal Server Error.')
+
+    if not inserted:
+        invalid_fields = [{'plan_code': 'already exists.'}]
+        return helpers.error_response(500, 'Internal Server Error.', invalid_fields)
+
+    response = {
+        'data': [helpers.serialize_plan(plan)],
+        'status_code': 200
+    }
+    return helpers.json_response(response, status=200)
+
+@csrf_exempt
+async def update(request, plan_id):
+    if request.method not in ['POST', 'PUT']:
+        return helpers.error_response(400, 'Bad Request.')
+
+    payload = json.loads(request.body or '{}')
+
+    invalid_fields = helpers.validates_payload_to_update(payload)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    try:
+        updated = await async_helpers.update_plan(plan_id, payload)
+    except IntegrityError:
+        invalid_fields = [{'plan_code': 'already exists.'}]
+        return helpers.error_response(500, 'Internal Server Error.', invalid_fields)
+
+    if not updated:
+        return helpers.error_response(404, 'Not Found.')
+
+    plan, _ = updated
+
+    # A patched price has always been echoed back as a number.
+    if 'price' in payload:
+        plan.price = float(plan.price)
+
+    response = {
+        'data': [helpers.serialize_plan(plan)],
+        'status_code': 200
+    }
+    return helpers.json_response(response, status=200)
+
+@csrf_exempt
+async def delete(request, plan_id):
+    if not request.method == 'POST':
+        return helpers.error_response(400, 'Bad Request.')
+
+    plan = await async_helpers.delete_plan(plan_id)
+    if not plan:
+        return helpers.error_response(404, 'Not Found.')
+
+    response = {
+        'data': [helpers.serialize_plan(plan)],
+        'status_code': 200
+    }
+    return helpers.json_response(response, status=200)
+
+@csrf_exempt
+async def list(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    queryset = dict(request.GET)
+
+    invalid_fields = helpers.validates_list_query(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    query = caching.normalize_query(queryset)
+
+    catalog_version, versions = await async_helpers.list_versions(query)
+
+    etag = helpers.build_etag(query, catalog_version)
+    if helpers.etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    key = caching.cache_key(query, versions)
+
+    cached = await async_helpers.get_cached(key)
+    if cached:
+        status_code, content = cached
+        response = HttpResponse(content, status=status_code, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    status_code, content = await async_helpers.load_list(key, queryset)
+    response = HttpResponse(content, status=status_code, content_type='application/json')
+    response['ETag'] = etag
+
+    return response
@@ -0,0 +1,217 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+
+from .models import Plans
+from . import helpers
+from .validators import INTEGER_MAX
+
+MAX_ITEMS = 1000
+PATCH_FIELDS = ['minutes', 'internet', 'price', 'plan_type', 'operator', 'ddds']
+PATCH_TYPES = ['integer', 'varchar', 'numeric', 'varchar', 'varchar', 'integer[]']
+FILTER_FIELDS = [
+    'ddds',
+    'ddd_match',
+    'operator',
+    'plan_type',
+    'plan_code',
+    'price_min',
+    'price_max',
+    'minutes_min',
+    'minutes_max'
+]
+RETURNING = ', '.join('p.%s' % field for field in helpers.PLAN_FIELDS)
+
+
+def validates_ids(ids, key):
+    if not isinstance(ids, list) or not ids:
+        return [{key: 'is empty.'}]
+
+    if len(ids) > MAX_ITEMS:
+        return [{key: 'must have at most %d items.' % MAX_ITEMS}]
+
+    if not all(type(plan_id) is int and -INTEGER_MAX - 1 <= plan_id <= INTEGER_MAX for plan_id in ids):
+        return [{key: 'is not a valid list of ids.'}]
+
+    if len(set(ids)) != len(ids):
+        return [{key: 'has duplicated ids.'}]
+
+    return []
+
+def filter_queryset(filters):
+    # Filters take the same names as the list query parameters, as JSON.
+    return {
+        key: [json.dumps(value) if key == 'ddds' else str(value)]
+        for key, value in filters.items()
+    }
+
+def validates_filter(filters):
+    if not isinstance(filters, dict):
+        return [{'filter': 'is not an object.'}]
+
+    invalid_fields = [
+        {'filter': '%s is not a valid filter.' % key} for key in filters if key not in FILTER_FIELDS
+    ]
+
+    # A filter always narrows by DDD, so a typo can't touch the whole catalog.
+    ddds = filters.get('ddds')
+    if not isinstance(ddds, list) or not ddds:
+        invalid_fields.append({'ddds': 'is required.'})
+    elif not helpers.PAYLOAD_VALIDATOR.is_ddds(ddds):
+        invalid_fields.append({'ddds': 'is not a valid choice.'})
+
+    if invalid_fields:
+        return invalid_fields
+
+    return helpers.validates_filters(filter_queryset(filters))
+
+def validates_patch(patch):
+    if not isinstance(patch, dict):
+        return [{'patch': 'is not an object.'}]
+
+    if 'plan_code' in patch:
+        return [{'plan_code': 'cannot be changed in bulk.'}]
+
+    if not any(field in patch for field in PATCH_FIELDS + ['price_percent']):
+        return [{'patch': 'has nothing to update.'}]
+
+    if 'price' in patch and 'price_percent' in patch:
+        return [{'price_percent': 'cannot be combined with price.'}]
+
+    invalid_fields = helpers.validates_payload_to_update(
+        {key: value for key, value in patch.items() if key != 'price_percent'})
+
+    if 'price_percent' in patch:
+        try:
+            percent = Decimal(str(patch['price_percent']))
+        except InvalidOperation:
+            percent = None
+
+        if percent is None or not percent.is_finite() or percent <= -100:
+            invalid_fields.append({'price_percent': 'is not a valid percentage.'})
+
+    return invalid_fields
+
+def validates_bulk_update(body):
+    if not isinstance(body, dict) or ('plans' in body) == ('filter' in body):
+        return {'body': [{'body': 'requires either plans or filter.'}]}
+
+    if 'filter' in body:
+        invalid_fields = validates_filter(body['filter']) + validates_patch(body.get('patch'))
+        return {'body': invalid_fields} if invalid_fields else {}
+
+    patches = body['plans']
+    if not isinstance(patches, list) or not all(isinstance(patch, dict) for patch in patches):
+        return {'body': [{'plans': 'is not a list of objects.'}]}
+
+    invalid_fields = validates_ids([patch.get('id') for patch in patches], 'plans')
+    if invalid_fields:
+        return {'body': invalid_fields}
+
+    # Per-row errors are keyed by the patch index, like the bulk create.
+    errors = {}
+    for index, patch in enumerate(patches):
+        invalid_fields = validates_patch({key: value for key, value in patch.items() if key != 'id'})
+        if invalid_fields:
+            errors[index] = invalid_fields
+
+    return errors
+
+def validates_bulk_delete(body):
+    if not isinstance(body, dict) or ('ids' in body) == ('filter' in body):
+        return [{'body': 'requires either ids or filter.'}]
+
+    if 'filter' in body:
+        return validates_filter(body['filter'])
+
+    return validates_ids(body['ids'], 'ids')
+
+def split_rows(rows):
+    # RETURNING gives the new row followed by the ddds and operator it had
+    # before, which the caller needs to invalidate the buckets it left.
+    plans = [helpers.serialize_row(row) for row in rows]
+    previous = [Plans(ddds=row[-2], operator=row[-1]) for row in rows]
+    return (plans, previous)
+
+def update_plans(patches):
+    # A single UPDATE ... FROM (VALUES ...) patches every row; NULL marks a
+    # field the patch leaves untouched, since all plan columns are NOT NULL.
+    values = []
+    params = []
+
+    for patch in patches:
+        values.append('(%s::integer, ' + ', '.join('%%s::%s' % cast for cast in PATCH_TYPES) + ')')
+        params.append(patch['id'])
+        params += [
+            helpers.patch_value(field, patch[field]) if field in patch else None for field in PATCH_FIELDS
+        ]
+
+    assignments = ', '.join('%s = COALESCE(v.%s, p.%s)' % (field, field, field) for field in PATCH_FIELDS)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE plans_plans AS p SET %s
+            FROM (VALUES %s) AS v (id, %s), plans_plans AS old
+            WHERE p.id = v.id AND old.id = p.id
+            RETURNING %s, old.ddds, old.operator
+            """ % (assignments, ', '.join(values), ', '.join(PATCH_FIELDS), RETURNING),
+            params)
+        rows = cursor.fetchall()
+
+    by_id = {row[0]: row for row in rows}
+    rows = [by_id[patch['id']] for patch in patches if patch['id'] in by_id]
+
+    return split_rows(rows)
+
+def update_filtered(filters, patch):
+    assignments = []
+    params = []
+
+    for field in PATCH_FIELDS:
+        if field in patch:
+            assignments.append('%s = %%s' % field)
+            params.append(helpers.patch_value(field, patch[field]))
+
+    if 'price_percent' in patch:
+        assignments.append('price = round(p.price * (1 + %s / 100.0), 2)')
+        params.append(Decimal(str(patch['price_percent'])))
+
+    ids_sql, ids_params = Plans.objects.filter(
+        *helpers.build_lookups(filter_queryset(filters))).values('id').query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE plans_plans AS p SET %s
+            FROM plans_plans AS old
+            WHERE old.id = p.id AND p.id IN (%s)
+            RETURNING %s, old.ddds, old.operator
+            """ % (', '.join(assignments), ids_sql, RETURNING),
+            params + [*ids_params])
+        rows = sorted(cursor.fetchall())
+
+    return split_rows(rows)
+
+def delete_plans(ids):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM plans_plans AS p WHERE p.id = ANY(%%s) RETURNING %s' % RETURNING,
+            [ids])
+        rows = cursor.fetchall()
+
+    by_id = {row[0]: row for row in rows}
+    return [helpers.serialize_row(by_id[plan_id]) for plan_id in ids if plan_id in by_id]
+
+def delete_filtered(filters):
+    ids_sql, ids_params = Plans.objects.filter(
+        *helpers.build_lookups(filter_queryset(filters))).values('id').query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM plans_plans AS p WHERE p.id IN (%s) RETURNING %s' % (ids_sql, RETURNING),
+            ids_params)
+        rows = sorted(cursor.fetchall())
+
+    return [helpers.serialize_row(row) for row in rows]
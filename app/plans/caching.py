@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import helpers
+
+LIST_CACHE_TIMEOUT = getattr(settings, 'PLANS_LIST_CACHE_TIMEOUT', 300)
+
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'coalesced': 0}
+_flights = {}
+
+
+def normalize_query(queryset):
+    query = {}
+
+    for key, values in queryset.items():
+        value = values[0]
+
+        if key == 'ddds':
+            value = sorted(set(helpers.parse_ddds(value)))
+        elif key in ['operator', 'plan_type']:
+            value = value.lower()
+
+        query[key] = value
+
+    return query
+
+def query_buckets(query):
+    # Without ddds the list returns the whole catalog, so it depends on
+    # every write.
+    if not query.get('ddds'):
+        return ['plans:bucket:all']
+
+    operator = query.get('operator', '*')
+    return ['plans:bucket:%s:%s' % (ddd, operator) for ddd in query['ddds']]
+
+def plan_buckets(plan):
+    buckets = ['plans:bucket:all']
+
+    for ddd in plan.ddds:
+        buckets.append('plans:bucket:%s:%s' % (ddd, plan.operator))
+        buckets.append('plans:bucket:%s:*' % ddd)
+
+    return buckets
+
+def list_versions(query):
+    # The catalog version, for the ETag, and the versions of the query's
+    # buckets, for the cache key, are read in one query. Bucket versions
+    # live in the database, so a write in any worker reaches every worker.
+    buckets = query_buckets(query)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.version, b.name, b.version
+            FROM plans_catalogversion AS c
+            LEFT JOIN plans_cachebucket AS b ON b.name = ANY(%s)
+            WHERE c.id = 1
+            """,
+            [buckets])
+        rows = cursor.fetchall()
+
+    catalog_version = rows[0][0] if rows else 0
+    versions = {name: version for _, name, version in rows if name is not None}
+
+    return (catalog_version, [versions.get(bucket, 0) for bucket in buckets])
+
+def cache_key(query, versions):
+    key = json.dumps([query, versions], sort_keys=True)
+    return 'plans:list:%s' % hashlib.md5(key.encode()).hexdigest()
+
+def get_cached(key):
+    cached = cache.get(key)
+
+    with _lock:
+        _counters['hits' if cached is not None else 'misses'] += 1
+
+    return cached
+
+def set_cached(key, status_code, content):
+    cache.set(key, (status_code, content), LIST_CACHE_TIMEOUT)
+
+def count_coalesced():
+    with _lock:
+        _counters['coalesced'] += 1
+
+def fetch_list(key, queryset):
+    response = helpers.list_response(queryset)
+    set_cached(key, response.status_code, response.content)
+
+    return (response.status_code, response.content)
+
+def load_list(key, queryset):
+    # Concurrent misses on the same key wait for the first one instead of
+    # running the same query, then share the content it serialised.
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+
+        if leader:
+            flight = _flights[key] = {'done': threading.Event(), 'result': None}
+
+    if not leader:
+        count_coalesced()
+        flight['done'].wait()
+
+        # The first request failed, so this one gets its own try.
+        if flight['result'] is None:
+            return fetch_list(key, queryset)
+
+        return flight['result']
+
+    try:
+        flight['result'] = fetch_list(key, queryset)
+        return flight['result']
+    finally:
+        with _lock:
+            del _flights[key]
+
+        flight['done'].set()
+
+def invalidate(buckets):
+    # Sorted, so concurrent writers lock the bucket rows in the same order.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO plans_cachebucket (name, version)
+            SELECT name, 1 FROM unnest(%s::varchar[]) AS name
+            ON CONFLICT (name) DO UPDATE SET version = plans_cachebucket.version + 1
+            """,
+            [sorted(set(buckets))])
+
+def stats():
+    with _lock:
+        hits = _counters['hits']
+        misses = _counters['misses']
+        coalesced = _counters['coalesced']
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'coalesced': coalesced,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None
+    }
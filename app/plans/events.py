@@ -0,0 +1,225 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from django.conf import settings
+from django.db import connections
+
+from . import helpers
+
+EVENTS_PATH = '/plans/events'
+CHANNEL = 'plans_changes'
+BUFFER_SIZE = getattr(settings, 'PLANS_EVENTS_BUFFER_SIZE', 100)
+HEARTBEAT = getattr(settings, 'PLANS_EVENTS_HEARTBEAT', 15)
+
+
+class Subscriber:
+    def __init__(self, ddd=None, operator=None, buffer_size=BUFFER_SIZE):
+        self.ddd = ddd
+        self.operator = operator
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def matches(self, event):
+        # An update matches on the plan as it was too, so the client hears
+        # about a plan that no longer fits its filter.
+        return self.fits(event) or ('previous' in event and self.fits(event['previous']))
+
+    def fits(self, plan):
+        if self.ddd is not None and self.ddd not in plan['ddds']:
+            return False
+
+        return self.operator is None or self.operator == plan['operator']
+
+    def publish(self, event):
+        # A client that can't keep up is cut off once its buffer is full,
+        # instead of holding an unbounded backlog in the worker.
+        if self.overflowed or not self.matches(event):
+            return
+
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def cut_off(self):
+        # Ends the stream with an overflow event, so the client resumes from
+        # /plans/changes; None wakes a stream waiting on an empty queue.
+        self.overflowed = True
+
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+
+class Broker:
+    # One LISTEN connection per worker process fans the notifications out to
+    # every subscriber of that process, read from the event loop itself.
+    def __init__(self):
+        self.subscribers = set()
+        self.connection = None
+        self.fileno = None
+        self.lock = asyncio.Lock()
+
+    def connect(self):
+        connection = psycopg2.connect(**connections['default'].get_connection_params())
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN %s' % CHANNEL)
+
+        return connection
+
+    async def subscribe(self, subscriber):
+        loop = asyncio.get_event_loop()
+
+        async with self.lock:
+            if self.connection is None:
+                self.connection = await loop.run_in_executor(None, self.connect)
+                self.fileno = self.connection.fileno()
+                loop.add_reader(self.fileno, self.read)
+
+            self.subscribers.add(subscriber)
+
+    async def unsubscribe(self, subscriber):
+        async with self.lock:
+            self.subscribers.discard(subscriber)
+
+            if not self.subscribers and self.connection is not None:
+                self.disconnect()
+
+    def disconnect(self):
+        asyncio.get_event_loop().remove_reader(self.fileno)
+        self.connection.close()
+        self.connection = None
+        self.fileno = None
+
+    def read(self):
+        # A dropped LISTEN connection may have lost notifications, so every
+        # subscriber is cut off and the next one to subscribe reconnects.
+        try:
+            self.connection.poll()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.disconnect()
+
+            for subscriber in [*self.subscribers]:
+                subscriber.cut_off()
+
+            return
+
+        while self.connection.notifies:
+            event = json.loads(self.connection.notifies.pop(0).payload)
+
+            for subscriber in [*self.subscribers]:
+                subscriber.publish(event)
+
+
+broker = None
+
+
+def get_broker():
+    # Created on first use, so its lock belongs to the server's event loop.
+    global broker
+
+    if broker is None:
+        broker = Broker()
+
+    return broker
+
+def format_event(event):
+    data = json.dumps(event, separators=(',', ':'))
+    return ('id: %s\nevent: %s\ndata: %s\n\n' % (event['revision'], event['action'], data)).encode()
+
+def validates_query(query):
+    invalid_fields = []
+
+    if 'ddd' in query.keys() and helpers.validates_ddd(query['ddd'][0]):
+        invalid_fields.append(helpers.validates_ddd(query['ddd'][0]))
+
+    return invalid_fields
+
+async def error_response(send, status_code, message, invalid_fields=None):
+    response_error = {'error': {'code': status_code, 'message': message}}
+
+    if invalid_fields:
+        response_error['error']['invalid_fields'] = invalid_fields
+
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(response_error).encode()})
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def stream(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await error_response(send, 400, 'Bad Request.')
+
+    query = parse_qs(scope['query_string'].decode())
+
+    invalid_fields = validates_query(query)
+    if invalid_fields:
+        return await error_response(send, 400, 'Bad Request.', invalid_fields)
+
+    subscriber = Subscriber(
+        ddd=int(query['ddd'][0]) if 'ddd' in query.keys() else None,
+        operator=query['operator'][0].lower() if 'operator' in query.keys() else None)
+
+    await get_broker().subscribe(subscriber)
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    revision = None
+
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+        while True:
+            # Buffered events are flushed before an overflowed client is told
+            # where to resume from /plans/changes.
+            if subscriber.overflowed and subscriber.queue.empty():
+                data = json.dumps({'since': revision})
+                body = ('event: overflow\ndata: %s\n\n' % data).encode()
+                await send({'type': 'http.response.body', 'body': body})
+                return
+
+            event = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait(
+                [event, disconnected], timeout=HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+
+            if disconnected in done:
+                event.cancel()
+                return
+
+            if event in done and event.result() is None:
+                continue
+
+            if event in done:
+                revision = event.result()['revision']
+                body = format_event(event.result())
+            else:
+                event.cancel()
+                body = b': ping\n\n'
+
+            # send() waits on the server's flow control, so a slow client
+            # stops draining its queue and ends up overflowing it.
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        await get_broker().unsubscribe(subscriber)
@@ -0,0 +1,43 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+EXPORT_PATH = '/plans/export'
+
+
+def response_headers(response):
+    headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+
+    return headers
+
+
+class ExportHandler(ASGIHandler):
+    # The request goes through the middleware and error handling like any
+    # other view, but Django 3.1 iterates streaming responses on the event
+    # loop, where the export's server-side cursor can't be read, so each
+    # chunk is pulled in the thread that opened it.
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+
+        chunks = iter(response)
+        try:
+            while True:
+                chunk = await sync_to_async(next, thread_sensitive=True)(chunks, None)
+                if chunk is None:
+                    break
+
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            # Sends request_finished, which returns the thread's connection.
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+        await send({'type': 'http.response.body'})
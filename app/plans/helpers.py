@@ -1,12 +1,83 @@
-import ast
+import base64
+import binascii
+import contextlib
+import hashlib
 import json
+from decimal import Decimal, InvalidOperation
 
-from django.db.models import Q
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.postgres.search import TrigramDistance
+from django.db import connection, transaction
+from django.db.models import BooleanField, F, Q, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.http import HttpResponse, JsonResponse
+from django.utils.module_loading import import_string
 from django.views.decorators.csrf import csrf_exempt
 
-from .models import Plans
+from .models import CatalogVersion, PlanTombstone, Plans
 from . import lists
+from . import stats
+from . import timing
+from .validators import INTEGER_MAX, PayloadValidator
+
+PAGE_MAX_LIMIT = 1000
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_MODES = ['prefix', 'similarity']
+DDD_MATCHES = ['all', 'any']
+CHEAPEST_DEFAULT_LIMIT = 3
+CHEAPEST_MAX_LIMIT = 20
+CHEAPEST_GROUPS = ['operator', 'plan_type']
+BULK_BATCH_SIZE = 1000
+BATCH_MAX_KEYS = 100
+CHANGES_DEFAULT_LIMIT = 100
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+PLAN_FIELDS = [
+    'id',
+    'plan_code',
+    'minutes',
+    'internet',
+    'price',
+    'plan_type',
+    'operator',
+    'ddds'
+]
+# Every ordering ends on id so it matches a (column, id) index and gives
+# cursors a unique key.
+ORDERINGS = {
+    'price': ['price', 'id'],
+    '-price': ['-price', '-id'],
+    'minutes': ['minutes', 'id'],
+}
+RANGE_FILTERS = {
+    'price_min': ('price__gte', Decimal),
+    'price_max': ('price__lte', Decimal),
+    'minutes_min': ('minutes__gte', int),
+    'minutes_max': ('minutes__lte', int),
+}
+REQUIRED_FIELDS = [
+    'plan_code',
+    'minutes',
+    'internet',
+    'price',
+    'plan_type',
+    'operator',
+    'ddds'
+]
+# Bit position of each DDD in the ddds_low/ddds_high masks, 63 per word.
+DDD_BITS = {ddd: position for position, ddd in enumerate(lists.DDDS_CHOICE)}
+DDDS_LOOKUP = getattr(settings, 'PLANS_DDDS_LOOKUP', 'array')
+PAYLOAD_VALIDATOR = PayloadValidator(
+    lists.DDDS_CHOICE, lists.PLAN_TYPES_CHOICE, REQUIRED_FIELDS,
+    max_lengths={
+        field: Plans._meta.get_field(field).max_length for field in ['plan_code', 'internet', 'operator']
+    },
+    price_digits=(Plans._meta.get_field('price').max_digits, Plans._meta.get_field('price').decimal_places))
 
 
 def error_response(status_code, exception, invalid_fields=None):
@@ -23,86 +94,787 @@ def error_response(status_code, exception, invalid_fields=None):
     return JsonResponse(response_error, status=status_code)
 
 def validates_payload(payload):
-    invalid_fields = []
+    return PAYLOAD_VALIDATOR.validate(payload)
 
-    for key in payload:
-        if not payload[key]:
-            invalid_fields.append({key: 'is empty.'})
+def validates_required_fields(payload):
+    return PAYLOAD_VALIDATOR.validate_required(payload)
 
-    if invalid_fields:
-        return invalid_fields
+def validates_payload_to_update(payload):
+    return PAYLOAD_VALIDATOR.validate(payload, partial=True)
 
+def parse_bulk_body(body):
     try:
-        int(payload['minutes'])
-    except ValueError:
-        invalid_fields.append({'minutes': 'is not a valid number.'})
+        body = body.decode().strip()
 
-    try:
-        float(payload['price'])
+        if body.startswith('['):
+            payloads = json.loads(body)
+        else:
+            payloads = [json.loads(line) for line in body.splitlines() if line.strip()]
     except ValueError:
-        invalid_fields.append({'price': 'is not a valid number.'})
+        return None
 
-    if payload['plan_type'] not in lists.PLAN_TYPES_CHOICE:
-        invalid_fields.append({'plan_type': 'is not a valid choice.'})
+    if not isinstance(payloads, list) or not payloads:
+        return None
 
-    for ddd in payload['ddds']:
-        if ddd not in lists.DDDS_CHOICE:
-            invalid_fields.append({'ddds': 'is not a valid choice.'})
+    return payloads
 
-    return invalid_fields
+def validates_bulk_payload(payloads):
+    errors = PAYLOAD_VALIDATOR.validate_batch(payloads)
+    plan_codes = [
+        (index, payload['plan_code'])
+        for index, payload in enumerate(payloads) if index not in errors
+    ]
 
-def validates_payload_to_update(payload):
-    invalid_fields = []
+    existing_plan_codes = set(
+        Plans.objects.filter(
+            plan_code__in=[plan_code for _, plan_code in plan_codes]
+        ).values_list('plan_code', flat=True))
 
-    for key in payload:
-        if not payload[key]:
-            invalid_fields.append({key: 'is empty.'})
+    seen_plan_codes = set()
+    for index, plan_code in plan_codes:
+        if plan_code in existing_plan_codes:
+            errors[index] = [{'plan_code': 'already exists.'}]
+        elif plan_code in seen_plan_codes:
+            errors[index] = [{'plan_code': 'is duplicated in the batch.'}]
 
-        elif key == 'minutes':
-            try:
-                int(payload['minutes'])
-            except ValueError:
-                invalid_fields.append({'minutes': 'is not a valid number.'})
+        seen_plan_codes.add(plan_code)
 
-        elif key == 'price':
-            try:
-                float(payload['price'])
-            except ValueError:
-                invalid_fields.append({'price': 'is not a valid number.'})
+    return errors
 
-        elif key == 'plan_type' and payload['plan_type'] not in lists.PLAN_TYPES_CHOICE:
-            invalid_fields.append({'plan_type': 'is not a valid choice.'})
+def build_plan(payload):
+    return Plans(
+        plan_code=payload['plan_code'],
+        minutes=int(payload['minutes']),
+        internet=payload['internet'],
+        price=float(payload['price']),
+        plan_type=payload['plan_type'].lower(),
+        operator=payload['operator'].lower(),
+        ddds=payload['ddds']
+    )
 
-        elif key == 'ddds':
-            for ddd in payload['ddds']:
-                if ddd not in lists.DDDS_CHOICE:
-                    invalid_fields.append({'ddds': 'is not a valid choice.'})
+def serialize_plan(plan):
+    price = plan.price
 
-    return invalid_fields
+    if isinstance(price, Decimal):
+        price = str(price)
+
+    return {
+        'id': plan.id,
+        'plan_code': plan.plan_code,
+        'minutes': plan.minutes,
+        'internet': plan.internet,
+        'price': price,
+        'plan_type': plan.plan_type,
+        'operator': plan.operator,
+        'ddds': plan.ddds
+    }
+
+def serialize_row(row, fields=PLAN_FIELDS):
+    # Builds the same dict as serialize_plan from a values_list(*fields)
+    # tuple, so listing never instantiates Plans. Extra trailing columns,
+    # selected only for pagination, are dropped by zip.
+    plan = dict(zip(fields, row))
+
+    if 'price' in plan:
+        plan['price'] = str(plan['price'])
+
+    return plan
+
+def get_json_dumps():
+    # PLANS_JSON_DUMPS may point at any dumps returning str or bytes, such as
+    # orjson.dumps. Payloads are already Decimal-free.
+    return import_string(settings.PLANS_JSON_DUMPS)
+
+def json_dumps(data, dumps=None):
+    content = (dumps or get_json_dumps())(data)
+    return content.encode() if isinstance(content, str) else content
+
+def json_response(data, status=200):
+    with timing.measure('serialize'):
+        content = json_dumps(data)
+
+    return HttpResponse(content, status=status, content_type='application/json')
+
+def insert_plan(plan):
+    # The unique constraint on plan_code rejects duplicates in the same
+    # statement, so there is no separate exists() round trip to race with.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO plans_plans
+                (plan_code, minutes, internet, price, plan_type, operator, ddds)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (plan_code) DO NOTHING
+            RETURNING id
+            """,
+            [plan.plan_code, plan.minutes, plan.internet, plan.price,
+             plan.plan_type, plan.operator, plan.ddds])
+        row = cursor.fetchone()
+
+    if row is None:
+        return False
+
+    plan.id = row[0]
+    return True
+
+def insert_plans(plans):
+    # Codes inserted by another request since the batch was validated are
+    # skipped by ON CONFLICT instead of failing the whole batch; the plans
+    # that don't come back are returned apart so they can be reported.
+    inserted = []
+    rejected = []
+
+    for start in range(0, len(plans), BULK_BATCH_SIZE):
+        batch = plans[start:start + BULK_BATCH_SIZE]
+        params = []
+
+        for plan in batch:
+            params += [plan.plan_code, plan.minutes, plan.internet, plan.price,
+                       plan.plan_type, plan.operator, plan.ddds]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO plans_plans
+                    (plan_code, minutes, internet, price, plan_type, operator, ddds)
+                VALUES %s
+                ON CONFLICT (plan_code) DO NOTHING
+                RETURNING id, plan_code
+                """ % ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(batch)),
+                params)
+            ids = {plan_code: plan_id for plan_id, plan_code in cursor.fetchall()}
+
+        for plan in batch:
+            if plan.plan_code in ids:
+                plan.id = ids[plan.plan_code]
+                inserted.append(plan)
+            else:
+                rejected.append(plan)
+
+    return (inserted, rejected)
+
+def upsert_plan(plan):
+    # The previous ddds and operator are read in the same statement so the
+    # caller can invalidate the cache buckets the row is leaving.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH previous AS (
+                SELECT ddds, operator FROM plans_plans WHERE plan_code = %(plan_code)s
+            )
+            INSERT INTO plans_plans
+                (plan_code, minutes, internet, price, plan_type, operator, ddds)
+            VALUES (
+                %(plan_code)s, %(minutes)s, %(internet)s, %(price)s,
+                %(plan_type)s, %(operator)s, %(ddds)s
+            )
+            ON CONFLICT (plan_code) DO UPDATE SET
+                minutes = EXCLUDED.minutes,
+                internet = EXCLUDED.internet,
+                price = EXCLUDED.price,
+                plan_type = EXCLUDED.plan_type,
+                operator = EXCLUDED.operator,
+                ddds = EXCLUDED.ddds
+            RETURNING
+                id, price, xmax = 0,
+                (SELECT ddds FROM previous), (SELECT operator FROM previous)
+            """,
+            {
+                'plan_code': plan.plan_code,
+                'minutes': plan.minutes,
+                'internet': plan.internet,
+                'price': plan.price,
+                'plan_type': plan.plan_type,
+                'operator': plan.operator,
+                'ddds': plan.ddds
+            })
+        plan.id, plan.price, created, previous_ddds, previous_operator = cursor.fetchone()
+
+    previous = None if created else Plans(ddds=previous_ddds or [], operator=previous_operator)
+    return (created, previous)
+
+def patch_value(field, value):
+    if field == 'minutes':
+        return int(value)
+    if field == 'price':
+        return Decimal(str(value))
+    if field in ['plan_type', 'operator']:
+        return value.lower()
+    return value
+
+def update_plan(plan_id, payload):
+    # Only the columns in the payload are written, in the same statement
+    # that reads the row back, so concurrent partial updates don't undo
+    # each other. The previous ddds and operator come from a self-join.
+    fields = [field for field in PLAN_FIELDS if field != 'id' and field in payload]
+
+    # Nothing is written, so there is no previous row to invalidate.
+    if not fields:
+        plan = get_plan_or_none(plan_id)
+        return (plan, None) if plan else None
+
+    # A duplicated plan_code is rejected by the unique constraint with an
+    # IntegrityError; the statement gets its own atomic block then, so an
+    # outer transaction survives it.
+    atomic = transaction.atomic() if 'plan_code' in fields else contextlib.nullcontext()
+
+    with atomic, connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE plans_plans AS p SET %s
+            FROM plans_plans AS old
+            WHERE p.id = %%s AND old.id = p.id
+            RETURNING %s, old.ddds, old.operator
+            """ % (
+                ', '.join('%s = %%s' % field for field in fields),
+                ', '.join('p.%s' % field for field in PLAN_FIELDS)),
+            [patch_value(field, payload[field]) for field in fields] + [plan_id])
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    plan = Plans(**dict(zip(PLAN_FIELDS, row)))
+    previous = Plans(ddds=row[-2], operator=row[-1])
+
+    return (plan, previous)
+
+def delete_plan(plan_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM plans_plans WHERE id = %%s RETURNING %s' % ', '.join(PLAN_FIELDS),
+            [plan_id])
+        row = cursor.fetchone()
+
+    return Plans(**dict(zip(PLAN_FIELDS, row))) if row else None
 
 def plan_code_already_exists(plan_code):
     return Plans.objects.filter(plan_code=plan_code).exists()
 
+def is_digits(value):
+    # str.isdigit() also accepts characters such as '²', which int() rejects.
+    return bool(value) and not value.strip('0123456789')
+
+def parse_ddds(value):
+    # ddds is a list of integers such as [21, 22]; anything else is None.
+    value = value.strip()
+    if not (value.startswith('[') and value.endswith(']')):
+        return None
+
+    items = [item.strip() for item in value[1:-1].split(',')]
+    if items == ['']:
+        return []
+
+    if not all(is_digits(item) for item in items):
+        return None
+
+    # The ddds column holds integers, so a larger number can't be compared.
+    ddds = [int(item) for item in items]
+    if any(ddd > INTEGER_MAX for ddd in ddds):
+        return None
+
+    return ddds
+
+def ddds_masks(ddds):
+    low = high = 0
+
+    for ddd in ddds:
+        position = DDD_BITS[ddd]
+        if position < 63:
+            low |= 1 << position
+        else:
+            high |= 1 << (position - 63)
+
+    return (low, high)
+
+def ddds_lookup(ddds, match='all'):
+    # 'array' tests the ddds array through its GIN index, 'bitset' tests the
+    # ddds_low/ddds_high masks with bitwise ands, see PLANS_DDDS_LOOKUP.
+    if DDDS_LOOKUP == 'array':
+        return Q(ddds__contains=ddds) if match == 'all' else Q(ddds__overlap=ddds)
+
+    known = [ddd for ddd in ddds if ddd in DDD_BITS]
+
+    # A DDD outside DDDS_CHOICE has no bit: no plan carries it.
+    if (match == 'all' and len(known) < len(ddds)) or (match == 'any' and not known):
+        return Q(pk__in=[])
+
+    low, high = ddds_masks(known)
+
+    if match == 'all':
+        sql = '("plans_plans"."ddds_low" & %s) = %s AND ("plans_plans"."ddds_high" & %s) = %s'
+        params = [low, low, high, high]
+    else:
+        sql = '("plans_plans"."ddds_low" & %s) <> 0 OR ("plans_plans"."ddds_high" & %s) <> 0'
+        params = [low, high]
+
+    return RawSQL('(%s)' % sql, params, output_field=BooleanField())
+
 def build_lookups(queryset):
+    # Only the filters that were asked for are returned, so the planner sees
+    # predicates it can match against the ddds GIN index and btree indexes.
     if 'ddds' in queryset.keys():
-        q_ddds = Q(ddds__contains=ast.literal_eval(queryset['ddds'][0]))
+        match = queryset['ddd_match'][0] if 'ddd_match' in queryset.keys() else 'all'
+        lookups = [ddds_lookup(parse_ddds(queryset['ddds'][0]), match)]
 
         if 'plan_type' in queryset.keys():
-            q_plan_type = Q(plan_type=queryset['plan_type'][0].lower())
-        else:
-            q_plan_type = Q(plan_type__isnull=False)
+            lookups.append(Q(plan_type=queryset['plan_type'][0].lower()))
 
         if 'operator' in queryset.keys():
-            q_operator = Q(operator=queryset['operator'][0].lower())
-        else:
-            q_operator = Q(operator__isnull=False)
+            lookups.append(Q(operator=queryset['operator'][0].lower()))
 
         if 'plan_code' in queryset.keys():
-            q_plan_code = Q(plan_code=queryset['plan_code'][0])
+            lookups.append(Q(plan_code=queryset['plan_code'][0]))
+
+        for param, (lookup, cast) in RANGE_FILTERS.items():
+            if param in queryset.keys():
+                lookups.append(Q(**{lookup: cast(queryset[param][0])}))
+
+        return lookups
+
+def validates_pagination(queryset):
+    invalid_fields = []
+
+    if 'limit' in queryset.keys():
+        try:
+            limit = int(queryset['limit'][0])
+        except ValueError:
+            invalid_fields.append({'limit': 'is not a valid number.'})
         else:
-            q_plan_code = Q(plan_code__isnull=False)
+            if not 0 < limit <= PAGE_MAX_LIMIT:
+                invalid_fields.append({'limit': 'must be between 1 and %d.' % PAGE_MAX_LIMIT})
+
+    elif 'cursor' in queryset.keys():
+        invalid_fields.append({'cursor': 'requires limit.'})
+
+    if 'cursor' in queryset.keys():
+        cursor = decode_cursor(queryset['cursor'][0])
+        order_by = queryset['order_by'][0] if 'order_by' in queryset.keys() else 'price'
+
+        if cursor is None:
+            invalid_fields.append({'cursor': 'is not a valid cursor.'})
+        elif cursor[0] != order_by:
+            invalid_fields.append({'cursor': 'was not made for order_by=%s.' % order_by})
+
+    return invalid_fields
+
+def validates_filters(queryset):
+    invalid_fields = []
+    values = {}
+
+    if 'ddds' in queryset.keys():
+        if parse_ddds(queryset['ddds'][0]) is None:
+            invalid_fields.append({'ddds': 'is not a valid list of numbers.'})
+    else:
+        # Without ddds every plan is returned, so these would be ignored.
+        for param in ['ddd_match'] + [*RANGE_FILTERS]:
+            if param in queryset.keys():
+                invalid_fields.append({param: 'requires ddds.'})
+
+    if 'ddd_match' in queryset.keys() and queryset['ddd_match'][0] not in DDD_MATCHES:
+        invalid_fields.append({'ddd_match': 'is not a valid choice.'})
+
+    for param, (lookup, cast) in RANGE_FILTERS.items():
+        if param in queryset.keys():
+            try:
+                value = cast(queryset[param][0])
+            except (ValueError, InvalidOperation):
+                value = None
+
+            if value is None or (cast is Decimal and not value.is_finite()):
+                invalid_fields.append({param: 'is not a valid number.'})
+            else:
+                values[param] = value
+
+    for name in ['price', 'minutes']:
+        minimum, maximum = values.get(name + '_min'), values.get(name + '_max')
+        if minimum is not None and maximum is not None and minimum > maximum:
+            invalid_fields.append({name + '_min': 'must not be greater than %s_max.' % name})
+
+    if 'order_by' in queryset.keys() and queryset['order_by'][0] not in ORDERINGS:
+        invalid_fields.append({'order_by': 'is not a valid choice.'})
+
+    return invalid_fields
+
+def validates_search(queryset):
+    invalid_fields = []
+
+    if 'plan_code_search' not in queryset.keys():
+        for param in ['search_mode', 'search_limit']:
+            if param in queryset.keys():
+                invalid_fields.append({param: 'requires plan_code_search.'})
+
+        return invalid_fields
+
+    if not queryset['plan_code_search'][0].strip():
+        invalid_fields.append({'plan_code_search': 'is empty.'})
+
+    if 'search_mode' in queryset.keys() and queryset['search_mode'][0] not in SEARCH_MODES:
+        invalid_fields.append({'search_mode': 'is not a valid choice.'})
+
+    if 'search_limit' in queryset.keys():
+        try:
+            limit = int(queryset['search_limit'][0])
+        except ValueError:
+            invalid_fields.append({'search_limit': 'is not a valid number.'})
+        else:
+            if not 0 < limit <= SEARCH_MAX_LIMIT:
+                invalid_fields.append({'search_limit': 'must be between 1 and %d.' % SEARCH_MAX_LIMIT})
+
+    # Search results are ranked by the match itself, so they are not paged.
+    for param in ['limit', 'cursor', 'order_by']:
+        if param in queryset.keys():
+            invalid_fields.append({param: 'cannot be combined with plan_code_search.'})
+
+    return invalid_fields
+
+def validates_ddd(value):
+    try:
+        ddd = int(value)
+    except ValueError:
+        return {'ddd': 'is not a valid number.'}
+
+    if ddd not in lists.DDDS_CHOICE:
+        return {'ddd': 'is not a valid choice.'}
+
+def validates_stats_query(queryset):
+    invalid_fields = []
+
+    if 'ddd' in queryset.keys() and validates_ddd(queryset['ddd'][0]):
+        invalid_fields.append(validates_ddd(queryset['ddd'][0]))
+
+    return invalid_fields
+
+def validates_cheapest_query(queryset):
+    invalid_fields = []
+
+    if 'ddd' not in queryset.keys():
+        invalid_fields.append({'ddd': 'is required.'})
+    elif validates_ddd(queryset['ddd'][0]):
+        invalid_fields.append(validates_ddd(queryset['ddd'][0]))
+
+    if 'per' in queryset.keys() and queryset['per'][0] not in CHEAPEST_GROUPS:
+        invalid_fields.append({'per': 'is not a valid choice.'})
+
+    if 'n' in queryset.keys():
+        try:
+            limit = int(queryset['n'][0])
+        except ValueError:
+            invalid_fields.append({'n': 'is not a valid number.'})
+        else:
+            if not 0 < limit <= CHEAPEST_MAX_LIMIT:
+                invalid_fields.append({'n': 'must be between 1 and %d.' % CHEAPEST_MAX_LIMIT})
+
+    return invalid_fields
+
+def parse_batch_keys(value):
+    keys = []
+    for key in value.split(','):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+
+    return keys
+
+def validates_batch_query(queryset):
+    params = [param for param in ['ids', 'plan_codes'] if param in queryset.keys()]
+
+    if len(params) != 1:
+        return [{'ids': 'either ids or plan_codes is required.'}]
+
+    param = params[0]
+    keys = parse_batch_keys(queryset[param][0])
+    invalid_fields = []
+
+    if not keys:
+        invalid_fields.append({param: 'is empty.'})
+    elif len(keys) > BATCH_MAX_KEYS:
+        invalid_fields.append({param: 'must have at most %d values.' % BATCH_MAX_KEYS})
+
+    if param == 'ids' and not all(is_digits(key) for key in keys):
+        invalid_fields.append({'ids': 'is not a valid list of numbers.'})
+
+    return invalid_fields + validates_fields(queryset)
+
+def validates_changes_query(queryset):
+    invalid_fields = []
+
+    if 'since' in queryset.keys():
+        since = queryset['since'][0]
+        if not is_digits(since):
+            invalid_fields.append({'since': 'is not a valid revision.'})
+
+    if 'limit' in queryset.keys():
+        try:
+            limit = int(queryset['limit'][0])
+        except ValueError:
+            invalid_fields.append({'limit': 'is not a valid number.'})
+        else:
+            if not 0 < limit <= PAGE_MAX_LIMIT:
+                invalid_fields.append({'limit': 'must be between 1 and %d.' % PAGE_MAX_LIMIT})
+
+    return invalid_fields
+
+def validates_list_query(queryset):
+    invalid_fields = validates_pagination(queryset) + validates_fields(queryset)
+    return invalid_fields + validates_filters(queryset) + validates_search(queryset)
+
+def search_plans(plans, queryset):
+    # Both modes are answered from the plan_code trigram index: prefix as a
+    # LIKE 'term%' and similarity through the pg_trgm % operator, ranked by
+    # the <-> distance, which the GiST index returns in order, so only the
+    # first search_limit matches are read.
+    term = queryset['plan_code_search'][0].strip()
+    mode = queryset['search_mode'][0] if 'search_mode' in queryset.keys() else 'prefix'
+
+    if mode == 'similarity':
+        plans = plans.filter(plan_code__trigram_similar=term).annotate(
+            distance=TrigramDistance('plan_code', term)).order_by('distance', 'id')
+    else:
+        plans = plans.filter(plan_code__startswith=term).order_by('plan_code')
+
+    limit = int(queryset['search_limit'][0]) if 'search_limit' in queryset.keys() else SEARCH_DEFAULT_LIMIT
+
+    return (plans, limit)
+
+def encode_cursor(order_by, value, plan_id):
+    # The ordering is part of the cursor, so it can't be replayed against
+    # another one, whose key it wouldn't compare with.
+    key = json.dumps([order_by, str(value), plan_id])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        order_by, value, plan_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if order_by not in ORDERINGS:
+            return None
+
+        return (order_by, (Decimal(value), int(plan_id)))
+    except (ValueError, TypeError, binascii.Error, InvalidOperation):
+        return None
+
+def validates_fields(queryset):
+    invalid_fields = []
+
+    if 'fields' in queryset.keys():
+        fields = [field.strip() for field in queryset['fields'][0].split(',')]
+
+        if not any(fields):
+            invalid_fields.append({'fields': 'is empty.'})
+
+        for field in fields:
+            if field and field not in PLAN_FIELDS:
+                invalid_fields.append({'fields': '%s is not a valid field.' % field})
+
+    return invalid_fields
+
+def parse_fields(queryset):
+    if 'fields' not in queryset.keys():
+        return PLAN_FIELDS
+
+    fields = []
+    for field in queryset['fields'][0].split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+
+    return fields
+
+def paginate(rows, limit, cursor=None, columns=PLAN_FIELDS, order_by='price'):
+    field = order_by.lstrip('-')
+    operator = '<' if order_by.startswith('-') else '>'
+    rows = rows.order_by(*ORDERINGS[order_by])
+
+    if cursor:
+        # A row-value comparison lets postgres walk the (field, id) index
+        # from the cursor onwards, backwards for descending orderings,
+        # instead of skipping OFFSET rows.
+        rows = rows.extra(
+            where=['("plans_plans"."%s", "plans_plans"."id") %s (%%s, %%s)' % (field, operator)],
+            params=decode_cursor(cursor)[1])
+
+    page = [row for row in rows[:limit + 1]]
+
+    next_cursor = None
+    if len(page) > limit:
+        last = page[limit - 1]
+        next_cursor = encode_cursor(order_by, last[columns.index(field)], last[columns.index('id')])
+
+    return (page[:limit], next_cursor)
+
+def list_response(queryset):
+    lookups = build_lookups(queryset)
+
+    if lookups:
+        plans = Plans.objects.filter(*lookups)
+    else:
+        plans = Plans.objects.all()
+
+    order_by = queryset['order_by'][0] if 'order_by' in queryset.keys() else 'price'
+
+    # Only the requested columns are selected; pagination also needs the
+    # (field, id) ordering key to build the next cursor.
+    fields = parse_fields(queryset)
+    columns = fields
+
+    if 'limit' in queryset.keys():
+        key = ['id', order_by.lstrip('-')]
+        columns = fields + [field for field in key if field not in fields]
+
+    if 'plan_code_search' in queryset.keys():
+        plans, search_limit = search_plans(plans, queryset)
+
+    rows = plans.values_list(*columns)
+
+    if 'plan_code_search' in queryset.keys():
+        rows = rows[:search_limit]
+
+    elif 'limit' in queryset.keys():
+        cursor = queryset['cursor'][0] if 'cursor' in queryset.keys() else None
+        rows, next_cursor = paginate(rows, int(queryset['limit'][0]), cursor, columns, order_by)
+
+    elif 'order_by' in queryset.keys():
+        rows = rows.order_by(*ORDERINGS[order_by])
+
+    with timing.measure('fetch'):
+        payload = [serialize_row(row, fields) for row in rows]
+
+    status_code = 200 if payload else 404
+
+    response = {
+        'data': payload,
+        'total': len(payload),
+        'status_code': status_code
+    }
+
+    if 'limit' in queryset.keys():
+        response['next_cursor'] = next_cursor
+
+    return json_response(response, status=status_code)
+
+def get_plans_batch(field, keys, fields=PLAN_FIELDS):
+    # One "= ANY(array)" query however many keys are asked for; the rows are
+    # then put back in the requested order.
+    columns = fields if field in fields else fields + [field]
+    rows = Plans.objects.values_list(*columns).extra(
+        where=['"plans_plans"."%s" = ANY(%%s)' % field], params=[keys])
+
+    index = columns.index(field)
+    found = {row[index]: row for row in rows}
+
+    plans = [serialize_row(found[key], fields) for key in keys if key in found]
+    missing = [key for key in keys if key not in found]
+
+    return (plans, missing)
+
+def get_changes(since, limit=CHANGES_DEFAULT_LIMIT):
+    # Plans and tombstones share the plans_revision_seq revisions, so both
+    # are read from their revision index and merged. A plan written several
+    # times since `since` only shows up once, with its latest state.
+    plans = Plans.objects.filter(revision__gt=since).order_by('revision').values_list(
+        *PLAN_FIELDS, 'revision', 'updated_at')[:limit + 1]
+    tombstones = PlanTombstone.objects.filter(revision__gt=since).order_by('revision').values_list(
+        'plan_id', 'plan_code', 'revision', 'deleted_at')[:limit + 1]
+
+    changes = [
+        {
+            'revision': row[-2],
+            'action': 'upsert',
+            'changed_at': row[-1].isoformat(),
+            'plan': serialize_row(row)
+        }
+        for row in plans
+    ]
+    changes += [
+        {
+            'revision': revision,
+            'action': 'delete',
+            'changed_at': deleted_at.isoformat(),
+            'plan': {'id': plan_id, 'plan_code': plan_code}
+        }
+        for plan_id, plan_code, revision, deleted_at in tombstones
+    ]
+    changes.sort(key=lambda change: change['revision'])
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    next_since = changes[-1]['revision'] if changes else since
+
+    return (changes, next_since, has_more)
+
+def cheapest_plans(ddd, group='operator', limit=CHEAPEST_DEFAULT_LIMIT):
+    # ROW_NUMBER() ranks each group's plans by price inside the ddds GIN index
+    # lookup, and only the first `limit` of each group leave the database.
+    ranked = Plans.objects.filter(ddds_lookup([ddd])).annotate(
+        rank=Window(
+            expression=RowNumber(),
+            partition_by=[F(group)],
+            order_by=[F('price').asc(), F('id').asc()])
+    ).values_list(*PLAN_FIELDS, 'rank')
+
+    sql, params = ranked.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT * FROM (%s) AS ranked WHERE rank <= %%s ORDER BY %s, rank' % (sql, group),
+            params + (limit,))
+        rows = cursor.fetchall()
+
+    return [serialize_row(row) for row in rows]
+
+def export_rows(plans, export_format, fields=PLAN_FIELDS):
+    # Rows come from a server-side cursor and are flushed once per chunk, so
+    # memory stays flat however many plans match.
+    rows = plans.order_by().values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    dumps = get_json_dumps()
+
+    if export_format == 'json':
+        yield b'{"data": ['
+
+    total = 0
+    chunk = []
+    for row in rows:
+        if export_format == 'ndjson':
+            chunk.append(json_dumps(serialize_row(row, fields), dumps) + b'\n')
+        else:
+            chunk.append((b', ' if total else b'') + json_dumps(serialize_row(row, fields), dumps))
+
+        total += 1
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield b''.join(chunk)
+
+    if export_format == 'json':
+        yield b'], "total": %d, "status_code": 200}' % total
+
+def get_catalog_version():
+    version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    return version or 0
+
+def bump_catalog_version():
+    updated = CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+
+    if not updated:
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    # Every write bumps the catalog version, so it is also where the stats
+    # view learns it is stale.
+    stats.schedule_refresh()
+
+def build_etag(query, version):
+    key = json.dumps([query, version], sort_keys=True)
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
 
-        return (q_ddds, q_plan_type, q_operator, q_plan_code)
+    etags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in etags or etag in etags or 'W/' + etag in etags
 
 def get_plan_or_none(plan_id):
     try:
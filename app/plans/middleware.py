@@ -0,0 +1,79 @@
+import asyncio
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from . import timing
+
+logger = logging.getLogger('plans.timing')
+
+
+def is_plans_view(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    return bool(resolver_match) and resolver_match.func.__module__.startswith('plans.')
+
+def sampled():
+    return random.random() < getattr(settings, 'PLANS_TIMING_SAMPLE_RATE', 0.0)
+
+def report(request, response, timings):
+    if not is_plans_view(request):
+        return response
+
+    durations = timings.as_dict()
+
+    response['Server-Timing'] = ', '.join([
+        'db;dur=%s;desc="%d queries"' % (durations['db_ms'], durations['queries']),
+        'fetch;dur=%s' % durations['fetch_ms'],
+        'serialize;dur=%s' % durations['serialize_ms'],
+        'view;dur=%s' % durations['view_ms'],
+    ])
+
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+    }
+    record.update(durations)
+    logger.info(json.dumps(record))
+
+    return response
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    # Records query count, DB, fetch, serialisation and view time for a
+    # sample of the plans requests and reports them in a Server-Timing
+    # header and a JSON log line on the plans.timing logger.
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not sampled():
+                return await get_response(request)
+
+            timings, token = timing.start()
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                timings.durations['view'] = time.perf_counter() - start
+                timing.stop(token)
+
+            return report(request, response, timings)
+    else:
+        def middleware(request):
+            if not sampled():
+                return get_response(request)
+
+            timings, token = timing.start()
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                timings.durations['view'] = time.perf_counter() - start
+                timing.stop(token)
+
+            return report(request, response, timings)
+
+    return middleware
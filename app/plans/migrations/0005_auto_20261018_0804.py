@@ -0,0 +1,17 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0004_auto_20200603_0153'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plans',
+            index=models.Index(fields=['price', 'id'], name='plans_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:05
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0005_auto_20261018_0804'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plans',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ddds'], name='plans_ddds_gin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plans',
+            index=models.Index(fields=['plan_code'], name='plans_plan_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plans',
+            index=models.Index(fields=['operator', 'plan_type'], name='plans_operator_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plans',
+            index=models.Index(fields=['plan_type'], name='plans_plan_type_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicated_plan_codes(apps, schema_editor):
+    # Plans saved before the constraint could race past the exists() check,
+    # so duplicates are reported instead of failing on an opaque IntegrityError.
+    Plans = apps.get_model('plans', 'Plans')
+    duplicated = (
+        Plans.objects.using(schema_editor.connection.alias)
+        .values('plan_code').annotate(total=Count('id')).filter(total__gt=1)
+        .values_list('plan_code', flat=True))
+
+    if duplicated:
+        raise RuntimeError(
+            'plans_plans has duplicated plan codes, which must be removed or renamed '
+            'before plans_plan_code_unique can be added: %s' % ', '.join(sorted(duplicated)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0007_catalogversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicated_plan_codes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='plans',
+            constraint=models.UniqueConstraint(fields=('plan_code',), name='plans_plan_code_unique'),
+        ),
+        migrations.RemoveIndex(
+            model_name='plans',
+            name='plans_plan_code_idx',
+        ),
+    ]
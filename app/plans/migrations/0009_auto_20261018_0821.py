@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0008_auto_20261018_0814'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plans',
+            index=models.Index(fields=['minutes', 'id'], name='plans_minutes_id_idx'),
+        ),
+    ]
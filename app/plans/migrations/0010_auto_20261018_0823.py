@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:23
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0009_auto_20261018_0821'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='plans',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['plan_code'], name='plans_plan_code_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0010_auto_20261018_0823'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE MATERIALIZED VIEW plans_stats AS
+            SELECT
+                ddd,
+                operator,
+                plan_type,
+                count(*) AS plans,
+                min(price) AS min_price,
+                round(avg(price), 2) AS avg_price,
+                max(price) AS max_price,
+                min(minutes) AS min_minutes,
+                round(avg(minutes), 2) AS avg_minutes,
+                max(minutes) AS max_minutes
+            FROM plans_plans, unnest(ddds) AS ddd
+            GROUP BY ddd, operator, plan_type;
+
+            CREATE UNIQUE INDEX plans_stats_ddd_operator_type_idx
+                ON plans_stats (ddd, operator, plan_type);
+            """,
+            'DROP MATERIALIZED VIEW plans_stats;'
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0011_plans_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plan_id', models.IntegerField()),
+                ('plan_code', models.CharField(max_length=50)),
+                ('revision', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='plans',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='plans',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='plans',
+            index=models.Index(fields=['revision'], name='plans_revision_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plantombstone',
+            index=models.Index(fields=['revision'], name='plans_tombstone_revision_idx'),
+        ),
+        migrations.RunSQL(
+            """
+            CREATE SEQUENCE plans_revision_seq;
+
+            CREATE FUNCTION plans_plans_revision() RETURNS trigger AS $$
+            BEGIN
+                -- Writers take revisions one transaction at a time, so a
+                -- revision is never committed after a higher one a client
+                -- may already have read from /plans/changes.
+                PERFORM pg_advisory_xact_lock(hashtext('plans_revision_seq'));
+
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO plans_plantombstone (plan_id, plan_code, revision, deleted_at)
+                    VALUES (OLD.id, OLD.plan_code, nextval('plans_revision_seq'), now());
+                    RETURN OLD;
+                END IF;
+
+                NEW.revision := nextval('plans_revision_seq');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER plans_plans_revision
+                BEFORE INSERT OR UPDATE OR DELETE ON plans_plans
+                FOR EACH ROW EXECUTE FUNCTION plans_plans_revision();
+
+            UPDATE plans_plans SET revision = 0;
+            """,
+            """
+            DROP TRIGGER plans_plans_revision ON plans_plans;
+            DROP FUNCTION plans_plans_revision();
+            DROP SEQUENCE plans_revision_seq;
+            """
+        ),
+    ]
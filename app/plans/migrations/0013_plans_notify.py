@@ -0,0 +1,81 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0012_plans_changes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE OR REPLACE FUNCTION plans_plans_revision() RETURNS trigger AS $$
+            DECLARE
+                revision bigint;
+            BEGIN
+                -- Writers take revisions one transaction at a time, so a
+                -- revision is never committed after a higher one a client
+                -- may already have read from /plans/changes.
+                PERFORM pg_advisory_xact_lock(hashtext('plans_revision_seq'));
+
+                IF TG_OP = 'DELETE' THEN
+                    revision := nextval('plans_revision_seq');
+
+                    INSERT INTO plans_plantombstone (plan_id, plan_code, revision, deleted_at)
+                    VALUES (OLD.id, OLD.plan_code, revision, now());
+
+                    PERFORM pg_notify('plans_changes', json_build_object(
+                        'revision', revision, 'action', 'delete', 'id', OLD.id,
+                        'plan_code', OLD.plan_code, 'operator', OLD.operator,
+                        'ddds', OLD.ddds)::text);
+
+                    RETURN OLD;
+                END IF;
+
+                NEW.revision := nextval('plans_revision_seq');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            -- Notified AFTER the row is written, so an upsert that ends up
+            -- updating is only announced as an update. Listeners get it on
+            -- commit.
+            CREATE FUNCTION plans_plans_notify() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('plans_changes', json_build_object(
+                    'revision', NEW.revision,
+                    'action', CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'update' END,
+                    'id', NEW.id, 'plan_code', NEW.plan_code,
+                    'operator', NEW.operator, 'ddds', NEW.ddds)::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER plans_plans_notify
+                AFTER INSERT OR UPDATE ON plans_plans
+                FOR EACH ROW EXECUTE FUNCTION plans_plans_notify();
+            """,
+            """
+            DROP TRIGGER plans_plans_notify ON plans_plans;
+            DROP FUNCTION plans_plans_notify();
+
+            CREATE OR REPLACE FUNCTION plans_plans_revision() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_advisory_xact_lock(hashtext('plans_revision_seq'));
+
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO plans_plantombstone (plan_id, plan_code, revision, deleted_at)
+                    VALUES (OLD.id, OLD.plan_code, nextval('plans_revision_seq'), now());
+                    RETURN OLD;
+                END IF;
+
+                NEW.revision := nextval('plans_revision_seq');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        ),
+    ]
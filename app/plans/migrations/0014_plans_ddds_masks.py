@@ -0,0 +1,63 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0013_plans_notify'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plans',
+            name='ddds_high',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='plans',
+            name='ddds_low',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            -- Bit n stands for the DDD at position n of plans/lists.py's
+            -- DDDS_CHOICE: positions 0-62 go in word 0 and 63-66 in word 1,
+            -- so both masks stay positive bigints.
+            CREATE FUNCTION plans_ddds_mask(ddds integer[], word integer) RETURNS bigint AS $$
+                SELECT coalesce(bit_or(1::bigint << (position - word * 63)), 0)
+                FROM (
+                    SELECT array_position(ARRAY[11,12,13,14,15,16,17,18,19,21,22,24,27,28,31,32,33,34,35,37,38,41,42,43,44,45,46,47,48,49,51,53,54,55,61,62,63,64,65,66,67,68,69,71,73,74,75,77,79,81,82,83,84,85,86,87,88,89,91,92,93,94,95,96,97,98,99], ddd) - 1 AS position
+                    FROM unnest(ddds) AS ddd
+                ) AS positions
+                WHERE position / 63 = word;
+            $$ LANGUAGE sql IMMUTABLE;
+
+            CREATE FUNCTION plans_plans_ddds_masks() RETURNS trigger AS $$
+            BEGIN
+                NEW.ddds_low := plans_ddds_mask(NEW.ddds, 0);
+                NEW.ddds_high := plans_ddds_mask(NEW.ddds, 1);
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER plans_plans_ddds_masks
+                BEFORE INSERT OR UPDATE ON plans_plans
+                FOR EACH ROW EXECUTE FUNCTION plans_plans_ddds_masks();
+
+            -- The backfill doesn't change any plan, so it doesn't bump
+            -- revisions or notify /plans/events subscribers.
+            ALTER TABLE plans_plans DISABLE TRIGGER plans_plans_revision;
+            ALTER TABLE plans_plans DISABLE TRIGGER plans_plans_notify;
+            UPDATE plans_plans SET ddds_low = 0;
+            ALTER TABLE plans_plans ENABLE TRIGGER plans_plans_revision;
+            ALTER TABLE plans_plans ENABLE TRIGGER plans_plans_notify;
+            """,
+            """
+            DROP TRIGGER plans_plans_ddds_masks ON plans_plans;
+            DROP FUNCTION plans_plans_ddds_masks();
+            DROP FUNCTION plans_ddds_mask(integer[], integer);
+            """
+        ),
+    ]
\ No newline at end of file
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0014_plans_ddds_masks'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            -- Writers take revisions one transaction at a time, so a revision
+            -- is never committed after a higher one a client may already have
+            -- read from /plans/changes. The lock is taken once per statement,
+            -- before any row is locked: taken per row, a writer holding a row
+            -- lock could wait on it while the lock holder waits on that row.
+            CREATE FUNCTION plans_plans_revision_lock() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_advisory_xact_lock(hashtext('plans_revision_seq'));
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER plans_plans_revision_lock
+                BEFORE INSERT OR UPDATE OR DELETE ON plans_plans
+                FOR EACH STATEMENT EXECUTE FUNCTION plans_plans_revision_lock();
+
+            CREATE OR REPLACE FUNCTION plans_plans_revision() RETURNS trigger AS $$
+            DECLARE
+                revision bigint;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    revision := nextval('plans_revision_seq');
+
+                    INSERT INTO plans_plantombstone (plan_id, plan_code, revision, deleted_at)
+                    VALUES (OLD.id, OLD.plan_code, revision, now());
+
+                    PERFORM pg_notify('plans_changes', json_build_object(
+                        'revision', revision, 'action', 'delete', 'id', OLD.id,
+                        'plan_code', OLD.plan_code, 'operator', OLD.operator,
+                        'ddds', OLD.ddds)::text);
+
+                    RETURN OLD;
+                END IF;
+
+                NEW.revision := nextval('plans_revision_seq');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            DROP TRIGGER plans_plans_revision_lock ON plans_plans;
+            DROP FUNCTION plans_plans_revision_lock();
+
+            CREATE OR REPLACE FUNCTION plans_plans_revision() RETURNS trigger AS $$
+            DECLARE
+                revision bigint;
+            BEGIN
+                PERFORM pg_advisory_xact_lock(hashtext('plans_revision_seq'));
+
+                IF TG_OP = 'DELETE' THEN
+                    revision := nextval('plans_revision_seq');
+
+                    INSERT INTO plans_plantombstone (plan_id, plan_code, revision, deleted_at)
+                    VALUES (OLD.id, OLD.plan_code, revision, now());
+
+                    PERFORM pg_notify('plans_changes', json_build_object(
+                        'revision', revision, 'action', 'delete', 'id', OLD.id,
+                        'plan_code', OLD.plan_code, 'operator', OLD.operator,
+                        'ddds', OLD.ddds)::text);
+
+                    RETURN OLD;
+                END IF;
+
+                NEW.revision := nextval('plans_revision_seq');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0015_plans_revision_lock'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            -- An update also carries the ddds and operator the plan had, so a
+            -- filtered subscriber hears about a plan that left its filter.
+            CREATE OR REPLACE FUNCTION plans_plans_notify() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM pg_notify('plans_changes', json_build_object(
+                        'revision', NEW.revision, 'action', 'create', 'id', NEW.id,
+                        'plan_code', NEW.plan_code, 'operator', NEW.operator,
+                        'ddds', NEW.ddds)::text);
+                ELSE
+                    PERFORM pg_notify('plans_changes', json_build_object(
+                        'revision', NEW.revision, 'action', 'update', 'id', NEW.id,
+                        'plan_code', NEW.plan_code, 'operator', NEW.operator,
+                        'ddds', NEW.ddds, 'previous', json_build_object(
+                            'operator', OLD.operator, 'ddds', OLD.ddds))::text);
+                END IF;
+
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION plans_plans_notify() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('plans_changes', json_build_object(
+                    'revision', NEW.revision,
+                    'action', CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'update' END,
+                    'id', NEW.id, 'plan_code', NEW.plan_code,
+                    'operator', NEW.operator, 'ddds', NEW.ddds)::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:20
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0016_plans_notify_previous'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='plans',
+            name='plans_plan_code_trgm_idx',
+        ),
+        migrations.AddIndex(
+            model_name='plans',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['plan_code'], name='plans_plan_code_gist_idx', opclasses=['gist_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0017_plans_plan_code_gist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheBucket',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
 from django.db import models
 
 
@@ -11,3 +12,48 @@ class Plans(models.Model):
     plan_type = models.CharField(max_length=8)
     operator = models.CharField(max_length=6)
     ddds = ArrayField(models.IntegerField())
+    # ddds as bitmasks over the positions of lists.DDDS_CHOICE, 63 per word,
+    # set by the plans_plans_ddds_masks trigger.
+    ddds_low = models.BigIntegerField(default=0, editable=False)
+    ddds_high = models.BigIntegerField(default=0, editable=False)
+    # Both are set by the plans_plans_revision trigger on every insert and
+    # update, including the raw SQL writes in helpers.
+    revision = models.BigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['revision'], name='plans_revision_idx'),
+            models.Index(fields=['price', 'id'], name='plans_price_id_idx'),
+            models.Index(fields=['minutes', 'id'], name='plans_minutes_id_idx'),
+            GinIndex(fields=['ddds'], name='plans_ddds_gin_idx'),
+            GistIndex(fields=['plan_code'], name='plans_plan_code_gist_idx', opclasses=['gist_trgm_ops']),
+            models.Index(fields=['operator', 'plan_type'], name='plans_operator_type_idx'),
+            models.Index(fields=['plan_type'], name='plans_plan_type_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['plan_code'], name='plans_plan_code_unique'),
+        ]
+
+
+class CatalogVersion(models.Model):
+    version = models.BigIntegerField(default=0)
+
+
+class CacheBucket(models.Model):
+    # Versions of the list cache buckets, kept in the database so a write in
+    # any worker reaches the cache keys of every worker.
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+
+class PlanTombstone(models.Model):
+    plan_id = models.IntegerField()
+    plan_code = models.CharField(max_length=50)
+    revision = models.BigIntegerField()
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['revision'], name='plans_tombstone_revision_idx'),
+        ]
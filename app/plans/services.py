@@ -1,13 +1,18 @@
 import ast
 import json
+import time
 
+from django.db import DataError, IntegrityError, transaction
 from django.db.models import Q
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from .models import Plans
 from . import lists
+from . import bulk
+from . import caching
 from . import helpers
+from . import stats
 
 
 @csrf_exempt
@@ -22,160 +27,376 @@ def create(request):
     if invalid_fields:
         return helpers.error_response(400, 'Bad Request.', invalid_fields)
 
-    if helpers.plan_code_already_exists(payload['plan_code']):
+    try:
+        plan = helpers.build_plan(payload)
+        inserted = helpers.insert_plan(plan)
+    except Exception:
+        return helpers.error_response(500, 'Internal Server Error.')
+
+    if not inserted:
         invalid_fields = [{'plan_code': 'already exists.'}]
         return helpers.error_response(500, 'Internal Server Error.', invalid_fields)
 
-    try:
-        plan = Plans(
-            plan_code=payload['plan_code'],
-            minutes=int(payload['minutes']),
-            internet=payload['internet'],
-            price=float(payload['price']),
-            plan_type=payload['plan_type'].lower(),
-            operator=payload['operator'].lower(),
-            ddds=payload['ddds']
-        )
-        plan.save()
-    except Exception:
-        helpers.error_response(500, 'Internal Server Error')
+    caching.invalidate(caching.plan_buckets(plan))
+    helpers.bump_catalog_version()
 
     response = {
-        'data': [
-            {
-                'id': plan.id,
-                'plan_code': plan.plan_code,
-                'minutes': plan.minutes,
-                'internet': plan.internet,
-                'price': plan.price,
-                'plan_type': plan.plan_type,
-                'operator': plan.operator,
-                'ddds': plan.ddds
-            }
-        ],
+        'data': [helpers.serialize_plan(plan)],
         'status_code': 200
     }
-    return JsonResponse(response, status=200)
+    return helpers.json_response(response, status=200)
+
+@csrf_exempt
+def bulk_create(request):
+    if not request.method == 'POST':
+        return helpers.error_response(400, 'Bad Request.')
+
+    start = time.perf_counter()
+
+    payloads = helpers.parse_bulk_body(request.body)
+    if payloads is None:
+        return helpers.error_response(400, 'Bad Request.')
+
+    errors = helpers.validates_bulk_payload(payloads)
+
+    indexes = {}
+    for index, payload in enumerate(payloads):
+        if index not in errors:
+            indexes[payload['plan_code']] = index
+
+    with transaction.atomic():
+        plans, rejected = helpers.insert_plans(
+            [helpers.build_plan(payloads[index]) for index in indexes.values()])
+
+    for plan in rejected:
+        errors[indexes[plan.plan_code]] = [{'plan_code': 'already exists.'}]
+
+    if plans:
+        caching.invalidate(
+            bucket for plan in plans for bucket in caching.plan_buckets(plan))
+        helpers.bump_catalog_version()
+
+    elapsed = time.perf_counter() - start
+
+    payload = [helpers.serialize_plan(plan) for plan in plans]
+
+    status_code = 200 if payload else 400
+
+    response = {
+        'data': payload,
+        'errors': [
+            {'row': index, 'invalid_fields': errors[index]} for index in sorted(errors)
+        ],
+        'total': len(payload),
+        'rows_per_second': round(len(payload) / elapsed, 2) if elapsed else None,
+        'status_code': status_code
+    }
+    return helpers.json_response(response, status=status_code)
+
+@csrf_exempt
+def bulk_update(request):
+    if not request.method == 'POST':
+        return helpers.error_response(400, 'Bad Request.')
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return helpers.error_response(400, 'Bad Request.')
+
+    errors = bulk.validates_bulk_update(body)
+    if 'body' in errors:
+        return helpers.error_response(400, 'Bad Request.', errors['body'])
+    if errors:
+        invalid_fields = [
+            {'row': index, 'invalid_fields': errors[index]} for index in sorted(errors)
+        ]
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    try:
+        with transaction.atomic():
+            if 'plans' in body:
+                plans, previous = bulk.update_plans(body['plans'])
+            else:
+                plans, previous = bulk.update_filtered(body['filter'], body['patch'])
+    except DataError:
+        # The patched fields were checked against the column limits, so only
+        # a percentage can take a price past them.
+        return helpers.error_response(400, 'Bad Request.', [
+            {'price_percent': 'must keep prices lower than %s.' % helpers.PAYLOAD_VALIDATOR.max_price}])
+
+    if plans:
+        caching.invalidate(
+            bucket
+            for plan in previous + [Plans(ddds=plan['ddds'], operator=plan['operator']) for plan in plans]
+            for bucket in caching.plan_buckets(plan))
+        helpers.bump_catalog_version()
+
+    status_code = 200 if plans else 404
+
+    response = {
+        'data': plans,
+        'total': len(plans),
+        'status_code': status_code
+    }
+
+    if 'plans' in body:
+        updated = {plan['id'] for plan in plans}
+        response['missing'] = [patch['id'] for patch in body['plans'] if patch['id'] not in updated]
+
+    return helpers.json_response(response, status=status_code)
+
+@csrf_exempt
+def bulk_delete(request):
+    if not request.method == 'POST':
+        return helpers.error_response(400, 'Bad Request.')
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return helpers.error_response(400, 'Bad Request.')
+
+    invalid_fields = bulk.validates_bulk_delete(body)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    with transaction.atomic():
+        if 'ids' in body:
+            plans = bulk.delete_plans(body['ids'])
+        else:
+            plans = bulk.delete_filtered(body['filter'])
+
+    if plans:
+        caching.invalidate(
+            bucket
+            for plan in plans
+            for bucket in caching.plan_buckets(Plans(ddds=plan['ddds'], operator=plan['operator'])))
+        helpers.bump_catalog_version()
+
+    status_code = 200 if plans else 404
+
+    response = {
+        'data': plans,
+        'total': len(plans),
+        'status_code': status_code
+    }
+
+    if 'ids' in body:
+        deleted = {plan['id'] for plan in plans}
+        response['missing'] = [plan_id for plan_id in body['ids'] if plan_id not in deleted]
+
+    return helpers.json_response(response, status=status_code)
 
 @csrf_exempt
 def update(request, plan_id):
     if request.method not in ['POST', 'PUT']:
         return helpers.error_response(400, 'Bad Request.')
 
-    plan = helpers.get_plan_or_none(plan_id)
-    if not plan:
-        return helpers.error_response(404, 'Not Found.')
-
-    payload = json.loads(request.body)
+    payload = json.loads(request.body or '{}')
 
     invalid_fields = helpers.validates_payload_to_update(payload)
     if invalid_fields:
         return helpers.error_response(400, 'Bad Request.', invalid_fields)
 
-    if 'plan_code' in payload and helpers.plan_code_already_exists(payload['plan_code']):
+    try:
+        updated = helpers.update_plan(plan_id, payload)
+    except IntegrityError:
         invalid_fields = [{'plan_code': 'already exists.'}]
         return helpers.error_response(500, 'Internal Server Error.', invalid_fields)
 
-    plan_code = payload['plan_code'] if 'plan_code' in payload else plan.plan_code
-    minutes = payload['minutes'] if 'minutes' in payload else plan.minutes
-    internet = payload['internet'] if 'internet' in payload else plan.internet
-    price = payload['price'] if 'price' in payload else plan.price
-    plan_type = payload['plan_type'] if 'plan_type' in payload else plan.plan_type
-    operator = payload['operator'] if 'operator' in payload else plan.operator
-    ddds = payload['ddds'] if 'ddds' in payload else plan.ddds
+    if not updated:
+        return helpers.error_response(404, 'Not Found.')
+
+    plan, previous = updated
 
-    try:
-        plan.plan_code=plan_code
-        plan.minutes=int(minutes)
-        plan.internet=internet
-        plan.price=float(price)
-        plan.plan_type=plan_type.lower()
-        plan.operator=operator.lower()
-        plan.ddds=ddds
-        plan.save()
-    except Exception:
-        helpers.error_response(500, 'Internal Server Error')
+    if previous is not None:
+        caching.invalidate(caching.plan_buckets(previous) + caching.plan_buckets(plan))
+        helpers.bump_catalog_version()
+
+    # A patched price has always been echoed back as a number.
+    if 'price' in payload:
+        plan.price = float(plan.price)
 
     response = {
-        'data': [
-            {
-                'id': plan.id,
-                'plan_code': plan.plan_code,
-                'minutes': plan.minutes,
-                'internet': plan.internet,
-                'price': plan.price,
-                'plan_type': plan.plan_type,
-                'operator': plan.operator,
-                'ddds': plan.ddds
-            }
-        ],
+        'data': [helpers.serialize_plan(plan)],
+        'status_code': 200
+    }
+    return helpers.json_response(response, status=200)
+
+@csrf_exempt
+def upsert(request, plan_code):
+    if request.method not in ['POST', 'PUT']:
+        return helpers.error_response(400, 'Bad Request.')
+
+    payload = json.loads(request.body)
+    payload['plan_code'] = plan_code
+
+    invalid_fields = (
+        helpers.validates_required_fields(payload) or helpers.validates_payload(payload))
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    plan = helpers.build_plan(payload)
+    created, previous = helpers.upsert_plan(plan)
+
+    stale_buckets = caching.plan_buckets(previous) if previous else []
+    caching.invalidate(stale_buckets + caching.plan_buckets(plan))
+    helpers.bump_catalog_version()
+
+    response = {
+        'data': [helpers.serialize_plan(plan)],
+        'created': created,
         'status_code': 200
     }
-    return JsonResponse(response, status=200)
+    return helpers.json_response(response, status=200)
 
 @csrf_exempt
 def delete(request, plan_id):
     if not request.method == 'POST':
         return helpers.error_response(400, 'Bad Request.')
 
-    plan = helpers.get_plan_or_none(plan_id)
+    plan = helpers.delete_plan(plan_id)
     if not plan:
         return helpers.error_response(404, 'Not Found.')
 
+    caching.invalidate(caching.plan_buckets(plan))
+    helpers.bump_catalog_version()
+
     response = {
-        'data': [
-            {
-                'id': plan.id,
-                'plan_code': plan.plan_code,
-                'minutes': plan.minutes,
-                'internet': plan.internet,
-                'price': plan.price,
-                'plan_type': plan.plan_type,
-                'operator': plan.operator,
-                'ddds': plan.ddds
-            }
-        ],
+        'data': [helpers.serialize_plan(plan)],
         'status_code': 200
     }
+    return helpers.json_response(response, status=200)
 
-    try:
-        plan.delete()
-    except Exception:
-        helpers.error_response(500, 'Internal Server Error')
+@csrf_exempt
+def list(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    queryset = dict(request.GET)
+
+    invalid_fields = helpers.validates_list_query(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    query = caching.normalize_query(queryset)
+
+    catalog_version, versions = caching.list_versions(query)
+
+    etag = helpers.build_etag(query, catalog_version)
+    if helpers.etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    key = caching.cache_key(query, versions)
+
+    cached = caching.get_cached(key)
+    if cached:
+        status_code, content = cached
+        response = HttpResponse(content, status=status_code, content_type='application/json')
+        response['ETag'] = etag
+        return response
 
-    return JsonResponse(response, status=200)
+    status_code, content = caching.load_list(key, queryset)
+    response = HttpResponse(content, status=status_code, content_type='application/json')
+    response['ETag'] = etag
+
+    return response
 
 @csrf_exempt
-def list(request):
+def export(request):
     if not request.method == 'GET':
         return helpers.error_response(400, 'Bad Request.')
 
-    payload = []
     queryset = dict(request.GET)
 
+    export_format = queryset['format'][0] if 'format' in queryset.keys() else 'ndjson'
+    if export_format not in helpers.EXPORT_CONTENT_TYPES:
+        invalid_fields = [{'format': 'is not a valid choice.'}]
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    invalid_fields = helpers.validates_fields(queryset) + helpers.validates_filters(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
     lookups = helpers.build_lookups(queryset)
 
     if lookups:
-        q_ddds, q_plan_type, q_operator, q_plan_code = lookups
-        plans = Plans.objects.filter(
-            q_ddds, q_plan_type, q_operator, q_plan_code)
+        plans = Plans.objects.filter(*lookups)
     else:
         plans = Plans.objects.all()
 
-    if plans:
-        for plan in plans:
-            payload.append(
-                {
-                    'id': plan.id,
-                    'plan_code': plan.plan_code,
-                    'minutes': plan.minutes,
-                    'internet': plan.internet,
-                    'price': plan.price,
-                    'plan_type': plan.plan_type,
-                    'operator': plan.operator,
-                    'ddds': plan.ddds
-                }
-            )
+    return StreamingHttpResponse(
+        helpers.export_rows(plans, export_format, helpers.parse_fields(queryset)),
+        content_type=helpers.EXPORT_CONTENT_TYPES[export_format])
+
+@csrf_exempt
+def changes(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    queryset = dict(request.GET)
+
+    invalid_fields = helpers.validates_changes_query(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    payload, next_since, has_more = helpers.get_changes(
+        int(queryset['since'][0]) if 'since' in queryset.keys() else 0,
+        int(queryset['limit'][0]) if 'limit' in queryset.keys() else helpers.CHANGES_DEFAULT_LIMIT)
+
+    response = {
+        'data': payload,
+        'total': len(payload),
+        'next_since': next_since,
+        'has_more': has_more,
+        'status_code': 200
+    }
+    return helpers.json_response(response, status=200)
+
+@csrf_exempt
+def batch(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    queryset = dict(request.GET)
+
+    invalid_fields = helpers.validates_batch_query(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    if 'ids' in queryset.keys():
+        field, keys = 'id', [int(key) for key in helpers.parse_batch_keys(queryset['ids'][0])]
+    else:
+        field, keys = 'plan_code', helpers.parse_batch_keys(queryset['plan_codes'][0])
+
+    plans, missing = helpers.get_plans_batch(field, keys, helpers.parse_fields(queryset))
+
+    status_code = 200 if plans else 404
+
+    response = {
+        'data': plans,
+        'missing': missing,
+        'total': len(plans),
+        'status_code': status_code
+    }
+    return helpers.json_response(response, status=status_code)
+
+@csrf_exempt
+def cheapest(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    queryset = dict(request.GET)
+
+    invalid_fields = helpers.validates_cheapest_query(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    payload = helpers.cheapest_plans(
+        int(queryset['ddd'][0]),
+        group=queryset['per'][0] if 'per' in queryset.keys() else 'operator',
+        limit=int(queryset['n'][0]) if 'n' in queryset.keys() else helpers.CHEAPEST_DEFAULT_LIMIT)
 
     status_code = 200 if payload else 404
 
@@ -184,4 +405,40 @@ def list(request):
         'total': len(payload),
         'status_code': status_code
     }
-    return JsonResponse(response, status=status_code)
+    return helpers.json_response(response, status=status_code)
+
+@csrf_exempt
+def plan_stats(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    queryset = dict(request.GET)
+
+    invalid_fields = helpers.validates_stats_query(queryset)
+    if invalid_fields:
+        return helpers.error_response(400, 'Bad Request.', invalid_fields)
+
+    payload = stats.fetch(
+        ddd=int(queryset['ddd'][0]) if 'ddd' in queryset.keys() else None,
+        operator=queryset['operator'][0].lower() if 'operator' in queryset.keys() else None,
+        plan_type=queryset['plan_type'][0].lower() if 'plan_type' in queryset.keys() else None)
+
+    status_code = 200 if payload else 404
+
+    response = {
+        'data': payload,
+        'total': len(payload),
+        'status_code': status_code
+    }
+    return helpers.json_response(response, status=status_code)
+
+@csrf_exempt
+def cache_stats(request):
+    if not request.method == 'GET':
+        return helpers.error_response(400, 'Bad Request.')
+
+    response = {
+        'data': caching.stats(),
+        'status_code': 200
+    }
+    return helpers.json_response(response, status=200)
@@ -0,0 +1,92 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+REFRESH_DELAY = getattr(settings, 'PLANS_STATS_REFRESH_DELAY', 5)
+STATS_FIELDS = [
+    'ddd',
+    'operator',
+    'plan_type',
+    'plans',
+    'min_price',
+    'avg_price',
+    'max_price',
+    'min_minutes',
+    'avg_minutes',
+    'max_minutes'
+]
+
+logger = logging.getLogger('plans.stats')
+
+_lock = threading.Lock()
+_timer = None
+
+
+def refresh():
+    # CONCURRENTLY rebuilds the view next to the old one, so dashboards keep
+    # reading the previous numbers instead of waiting on the refresh lock.
+    with connection.cursor() as cursor:
+        cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY plans_stats')
+
+def refresh_later():
+    global _timer
+
+    with _lock:
+        _timer = None
+
+    try:
+        refresh()
+    except DatabaseError:
+        logger.exception('Could not refresh plans_stats.')
+    finally:
+        connection.close()
+
+def start_timer():
+    global _timer
+
+    with _lock:
+        if _timer is None:
+            _timer = threading.Timer(REFRESH_DELAY, refresh_later)
+            _timer.daemon = True
+            _timer.start()
+
+def schedule_refresh():
+    # Writes within REFRESH_DELAY seconds of each other share one refresh, so
+    # a burst of writes doesn't rebuild the view once per plan.
+    if REFRESH_DELAY is None:
+        return
+
+    if REFRESH_DELAY:
+        transaction.on_commit(start_timer)
+    else:
+        transaction.on_commit(refresh)
+
+def fetch(ddd=None, operator=None, plan_type=None):
+    where = []
+    params = []
+
+    for column, value in [('ddd', ddd), ('operator', operator), ('plan_type', plan_type)]:
+        if value is not None:
+            where.append('%s = %%s' % column)
+            params.append(value)
+
+    sql = 'SELECT %s FROM plans_stats' % ', '.join(STATS_FIELDS)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY ddd, operator, plan_type'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    return [serialize_row(row) for row in rows]
+
+def serialize_row(row):
+    stats = dict(zip(STATS_FIELDS, row))
+
+    for field in ['min_price', 'avg_price', 'max_price', 'avg_minutes']:
+        stats[field] = str(stats[field])
+
+    return stats
@@ -1,10 +1,27 @@
+import asyncio
 import json
-
-from django.test import TestCase
-from django.urls import reverse
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.test import (
+    Client, RequestFactory, TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 
 from ddt import data, ddt, unpack
-from .models import Plans
+from .models import CacheBucket, Plans
+from . import async_services, caching, events, helpers, lists, stats
+from .middleware import server_timing_middleware
+
+
+def compact_dumps(data):
+    return json.dumps(data, separators=(',', ':')).encode()
 
 @ddt
 class PlanCreateTestCase(TestCase):
@@ -113,6 +130,14 @@ class PlanCreateTestCase(TestCase):
         self.assertContains(
             response, '"invalid_fields": [{"plan_code": "already exists."', status_code=500)
 
+    def test_database_error_on_insert(self):
+        with mock.patch.object(helpers, 'insert_plan', side_effect=DatabaseError('numeric field overflow')):
+            response = self.client.post(
+                reverse('create'), data=self.payload, content_type=self.content_type)
+
+        self.assertContains(
+            response, '"message": "Internal Server Error."', status_code=500)
+
 
 @ddt
 class PlanUpdateTestCase(TestCase):
@@ -179,8 +204,10 @@ class PlanUpdateTestCase(TestCase):
             response, '"invalid_fields": [{"'+field+'": "'+message+'"', status_code=400)
 
     def test_request_duplicate_plan_code(self):
-        result = self.client.post(
+        self.client.post(
             reverse('create'), data=self.payload, content_type=self.content_type)
+        result = self.client.post(
+            reverse('create'), data=dict(self.payload, plan_code='Oi2'), content_type=self.content_type)
 
         data = json.loads(result.content)
         plan_id = data['data'][0]['id']
@@ -348,6 +375,7 @@ class PlanListTestCase(TestCase):
 
     def tearDown(self):
         Plans.objects.all().delete()
+        cache.clear()
 
     def test_request_invalid(self):
         response = self.client.post(
@@ -425,6 +453,7 @@ class PlanSearchTestCase(TestCase):
 
     def tearDown(self):
         Plans.objects.all().delete()
+        cache.clear()
 
     def test_invalid_ddd_filter(self):
         querystring = 'ddds=[00]'
@@ -584,3 +613,2180 @@ class PlanSearchTestCase(TestCase):
         self.assertEqual(response.request['REQUEST_METHOD'], 'GET')
         self.assertContains(response, '"plan_code": "TimControle20gb200"')
         self.assertContains(response, '"total": 1')
+
+
+class PlanPaginationTestCase(TestCase):
+    def setUp(self):
+        self.url = '/plans/?'
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        for plan_code, price in [('Oi3', '39.90'), ('Oi1', '19.90'), ('Oi2', '29.90')]:
+            payload = dict(self.payload, plan_code=plan_code, price=price)
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def test_first_page(self):
+        path = self.url + 'ddds=[21]&limit=2'
+
+        response = self.client.get(path, content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/json')
+        self.assertEqual(
+            [plan['plan_code'] for plan in data['data']], ['Oi1', 'Oi2'])
+        self.assertEqual(data['total'], 2)
+        self.assertTrue(data['next_cursor'])
+
+    def test_next_page(self):
+        path = self.url + 'ddds=[21]&limit=2'
+        first = json.loads(
+            self.client.get(path, content_type=self.content_type).content)
+
+        path = path + '&cursor=' + first['next_cursor']
+        response = self.client.get(path, content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi3'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_without_limit_returns_everything(self):
+        path = self.url + 'ddds=[21]'
+
+        response = self.client.get(path, content_type=self.content_type)
+
+        self.assertContains(response, '"total": 3')
+        self.assertNotContains(response, 'next_cursor')
+
+    def test_invalid_limit(self):
+        path = self.url + 'ddds=[21]&limit=abc'
+
+        response = self.client.get(path, content_type=self.content_type)
+
+        self.assertContains(response, '"code": 400', status_code=400)
+        self.assertContains(
+            response, '"invalid_fields": [{"limit": "is not a valid number."', status_code=400)
+
+    def test_invalid_cursor(self):
+        path = self.url + 'ddds=[21]&limit=2&cursor=abc'
+
+        response = self.client.get(path, content_type=self.content_type)
+
+        self.assertContains(response, '"code": 400', status_code=400)
+        self.assertContains(
+            response, '"invalid_fields": [{"cursor": "is not a valid cursor."', status_code=400)
+
+    def test_cursor_of_another_ordering(self):
+        path = self.url + 'ddds=[21]&limit=2'
+        first = json.loads(self.client.get(path).content)
+
+        response = self.client.get(path + '&order_by=minutes&cursor=' + first['next_cursor'])
+
+        self.assertContains(
+            response, '"invalid_fields": [{"cursor": "was not made for order_by=minutes."',
+            status_code=400)
+
+
+@ddt
+class PlanIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Seeded in SQL so the table is large enough for the planner to
+        # prefer the indexes over a sequential scan.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO plans_plans
+                    (plan_code, minutes, internet, price, plan_type, operator, ddds)
+                SELECT
+                    'Plan' || n,
+                    100 * (1 + n %% 5),
+                    '10GB',
+                    10 + (n %% 19000) / 100.0,
+                    (%s)[1 + n %% 3],
+                    (ARRAY['oi', 'tim', 'vivo', 'claro'])[1 + n %% 4],
+                    ARRAY[(%s)[1 + n %% 67], (%s)[1 + (n / 67) %% 67]]
+                FROM generate_series(1, 200000) AS n
+                """,
+                [['controle', 'pós', 'pré'], lists.DDDS_CHOICE, lists.DDDS_CHOICE])
+            cursor.execute('ANALYZE plans_plans')
+
+    @data(
+        {'ddds': ['[21]']},
+        {'ddds': ['[21, 11]']},
+        {'ddds': ['[21]'], 'plan_type': ['Controle']},
+        {'ddds': ['[21]'], 'operator': ['Tim']},
+        {'ddds': ['[21]'], 'plan_code': ['Plan10']},
+        {'ddds': ['[21]'], 'plan_type': ['Pós'], 'operator': ['Oi'], 'plan_code': ['Plan10']},
+        {'ddds': ['[21]'], 'price_max': ['50']},
+        {'ddds': ['[21]'], 'minutes_min': ['200'], 'minutes_max': ['300']},
+    )
+    def test_lookups_use_indexes(self, queryset):
+        lookups = helpers.build_lookups(queryset)
+
+        plan = Plans.objects.filter(*lookups).explain()
+
+        self.assertNotIn('Seq Scan', plan)
+
+    @data('prefix', 'similarity')
+    def test_plan_code_search_uses_trigram_index(self, mode):
+        queryset = {'plan_code_search': ['Plan19999'], 'search_mode': [mode]}
+        plans, limit = helpers.search_plans(Plans.objects.all(), queryset)
+
+        plan = plans[:limit].explain()
+
+        self.assertNotIn('Seq Scan', plan)
+
+    @data('price', '-price', 'minutes')
+    def test_orderings_use_indexes(self, order_by):
+        queryset = {'ddds': ['[21]'], 'price_max': ['50']}
+        rows = Plans.objects.filter(*helpers.build_lookups(queryset)).values_list('id', 'price', 'minutes')
+
+        rows = rows.order_by(*helpers.ORDERINGS[order_by])[:20]
+        plan = rows.explain()
+
+        self.assertNotIn('Seq Scan', plan)
+
+
+class PlanBulkCreateTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+
+    def test_request_invalid(self):
+        response = self.client.get(
+            reverse('bulk_create'), content_type=self.content_type)
+
+        self.assertContains(
+            response,
+            b'{"error": {"code": 400, "message": "Bad Request."}}',
+            status_code=400)
+
+    def test_request_with_invalid_body(self):
+        response = self.client.post(
+            reverse('bulk_create'), data='{"plan_code": ', content_type=self.content_type)
+
+        self.assertContains(
+            response,
+            b'{"error": {"code": 400, "message": "Bad Request."}}',
+            status_code=400)
+
+    def test_bulk_create_from_json_array(self):
+        payloads = [
+            dict(self.payload, plan_code='Oi1'),
+            dict(self.payload, plan_code='Oi2'),
+        ]
+
+        response = self.client.post(
+            reverse('bulk_create'), data=json.dumps(payloads), content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['errors'], [])
+        self.assertIn('rows_per_second', data)
+        self.assertEqual(
+            Plans.objects.filter(plan_code__in=['Oi1', 'Oi2']).count(), 2)
+
+    def test_bulk_create_from_ndjson(self):
+        body = '\n'.join(
+            json.dumps(dict(self.payload, plan_code=plan_code))
+            for plan_code in ['Oi1', 'Oi2', 'Oi3']
+        )
+
+        response = self.client.post(
+            reverse('bulk_create'), data=body, content_type='application/x-ndjson')
+
+        self.assertContains(response, '"total": 3')
+        self.assertEqual(Plans.objects.count(), 3)
+
+    def test_bulk_create_reports_row_errors(self):
+        self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+
+        payloads = [
+            dict(self.payload, plan_code='Oi1'),
+            dict(self.payload, plan_code='Oi1'),
+            dict(self.payload),
+            dict(self.payload, plan_code='Oi2', minutes='100a'),
+            {'plan_code': 'Oi3'},
+        ]
+
+        response = self.client.post(
+            reverse('bulk_create'), data=json.dumps(payloads), content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['errors'][0], {
+            'row': 1, 'invalid_fields': [{'plan_code': 'is duplicated in the batch.'}]})
+        self.assertEqual(data['errors'][1], {
+            'row': 2, 'invalid_fields': [{'plan_code': 'already exists.'}]})
+        self.assertEqual(data['errors'][2], {
+            'row': 3, 'invalid_fields': [{'minutes': 'is not a valid number.'}]})
+        self.assertEqual(data['errors'][3]['row'], 4)
+        self.assertIn({'minutes': 'is required.'}, data['errors'][3]['invalid_fields'])
+        self.assertEqual(Plans.objects.count(), 2)
+
+    def test_bulk_create_reports_column_limits(self):
+        payloads = [
+            dict(self.payload, plan_code=['x']),
+            dict(self.payload, plan_code='Oi1', price=123456789),
+            dict(self.payload, plan_code='Oi2', operator='Operadora'),
+            dict(self.payload, plan_code='O' * 51),
+            dict(self.payload, plan_code='Oi3', internet='10GB' * 3),
+            dict(self.payload, plan_code='Oi4'),
+        ]
+
+        response = self.client.post(
+            reverse('bulk_create'), data=json.dumps(payloads), content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total'], 1)
+        self.assertEqual([error['row'] for error in data['errors']], [0, 1, 2, 3, 4])
+        self.assertEqual(data['errors'][1]['invalid_fields'], [{'price': 'must be lower than 10000.'}])
+        self.assertEqual(
+            data['errors'][2]['invalid_fields'], [{'operator': 'must be a text of at most 6 characters.'}])
+
+    def test_bulk_create_reports_prices_with_large_exponents(self):
+        payloads = [dict(self.payload, plan_code='Oi1', price='1e30'), dict(self.payload, plan_code='Oi2')]
+
+        response = self.client.post(
+            reverse('bulk_create'), data=json.dumps(payloads), content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi2'])
+        self.assertEqual(data['errors'], [
+            {'row': 0, 'invalid_fields': [{'price': 'must be lower than 10000.'}]}])
+
+    def test_bulk_create_reports_codes_inserted_since_validation(self):
+        self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+
+        payloads = [dict(self.payload, plan_code='Oi1'), dict(self.payload)]
+
+        # Validation ran before another request inserted OiPos10gb100.
+        with mock.patch.object(helpers, 'validates_bulk_payload', return_value={}):
+            response = self.client.post(
+                reverse('bulk_create'), data=json.dumps(payloads), content_type=self.content_type)
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi1'])
+        self.assertEqual(data['errors'], [
+            {'row': 1, 'invalid_fields': [{'plan_code': 'already exists.'}]}])
+        self.assertEqual(Plans.objects.count(), 2)
+
+
+class PlanExportTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+
+        payload = dict(self.payload, plan_code='TimControle20gb200', operator='Tim', ddds=[11])
+        self.client.post(
+            reverse('create'), data=payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+
+    def test_request_invalid(self):
+        response = self.client.post(reverse('export'), content_type=self.content_type)
+
+        self.assertContains(
+            response,
+            b'{"error": {"code": 400, "message": "Bad Request."}}',
+            status_code=400)
+
+    def test_invalid_format(self):
+        response = self.client.get(reverse('export') + '?format=xml')
+
+        self.assertContains(
+            response,
+            '"invalid_fields": [{"format": "is not a valid choice."', status_code=400)
+
+    def test_export_ndjson(self):
+        response = self.client.get(reverse('export'))
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        plans = [json.loads(line) for line in lines]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['content-type'], 'application/x-ndjson')
+        self.assertEqual(
+            sorted(plan['plan_code'] for plan in plans),
+            ['OiPos10gb100', 'TimControle20gb200'])
+        self.assertEqual(plans[0]['price'], '29.75')
+
+    def test_export_json_with_filters(self):
+        response = self.client.get(reverse('export') + '?format=json&ddds=[21]')
+
+        data = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/json')
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['data'][0]['plan_code'], 'OiPos10gb100')
+
+
+class PlanListCacheTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        result = self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+        self.plan_id = json.loads(result.content)['data'][0]['id']
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def test_normalized_queries_share_an_entry(self):
+        self.client.get('/plans/?ddds=[22, 21]&operator=Oi')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/plans/?operator=oi&ddds=[21,22]')
+
+        self.assertFalse([query for query in queries if 'plans_plans' in query['sql']])
+
+        self.assertContains(response, '"plan_code": "OiPos10gb100"')
+        self.assertEqual(response['content-type'], 'application/json')
+
+    def test_create_invalidates_the_affected_buckets(self):
+        self.client.get('/plans/?ddds=[21]')
+
+        payload = dict(self.payload, plan_code='Oi2')
+        self.client.post(
+            reverse('create'), data=payload, content_type=self.content_type)
+
+        response = self.client.get('/plans/?ddds=[21]')
+
+        self.assertContains(response, '"total": 2')
+
+    def test_other_buckets_are_kept(self):
+        self.client.get('/plans/?ddds=[21]&operator=oi')
+
+        payload = dict(self.payload, plan_code='Tim1', operator='Tim')
+        self.client.post(
+            reverse('create'), data=payload, content_type=self.content_type)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/plans/?ddds=[21]&operator=oi')
+
+        self.assertFalse([query for query in queries if 'plans_plans' in query['sql']])
+
+    def test_buckets_moved_by_another_worker(self):
+        response = self.client.get('/plans/?ddds=[21]')
+
+        # Another worker's write only reaches this worker's cache through the
+        # bucket versions in the database.
+        Plans.objects.create(
+            plan_code='Oi2', minutes=100, internet='10GB', price='19.90',
+            plan_type='pós', operator='oi', ddds=[21])
+        CacheBucket.objects.filter(name='plans:bucket:21:*').update(version=F('version') + 1)
+        helpers.bump_catalog_version()
+
+        fresh = self.client.get('/plans/?ddds=[21]')
+
+        self.assertContains(fresh, '"total": 2')
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+
+    def test_update_invalidates_old_and_new_buckets(self):
+        self.client.get('/plans/?ddds=[21]')
+        self.client.get('/plans/?ddds=[11]')
+
+        self.client.put(
+            reverse('update', args=[self.plan_id]), data={'ddds': [11]},
+            content_type=self.content_type)
+
+        self.assertContains(self.client.get('/plans/?ddds=[21]'), '"total": 0', status_code=404)
+        self.assertContains(self.client.get('/plans/?ddds=[11]'), '"total": 1')
+
+    def test_delete_invalidates_the_affected_buckets(self):
+        self.client.get('/plans/?ddds=[22]')
+
+        self.client.post(reverse('delete', args=[self.plan_id]))
+
+        self.assertContains(self.client.get('/plans/?ddds=[22]'), '"total": 0', status_code=404)
+
+    def test_cache_stats(self):
+        self.client.get('/plans/?ddds=[21]')
+        self.client.get('/plans/?ddds=[21]')
+
+        response = self.client.get(reverse('cache_stats'))
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(data['data']['hits'], 1)
+        self.assertGreaterEqual(data['data']['misses'], 1)
+
+
+class PlanListETagTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def test_list_returns_etag(self):
+        response = self.client.get('/plans/?ddds=[21]')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+
+    def test_not_modified_skips_the_plans_table(self):
+        etag = self.client.get('/plans/?ddds=[21]')['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/plans/?ddds=[21]', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertFalse([query for query in queries if 'plans_plans' in query['sql']])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_changes_after_write(self):
+        etag = self.client.get('/plans/?ddds=[21]')['ETag']
+
+        payload = dict(self.payload, plan_code='Oi2')
+        self.client.post(
+            reverse('create'), data=payload, content_type=self.content_type)
+
+        response = self.client.get('/plans/?ddds=[21]', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, '"total": 2')
+
+    def test_etag_depends_on_the_query(self):
+        etag = self.client.get('/plans/?ddds=[21]')['ETag']
+
+        response = self.client.get('/plans/?ddds=[22]', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class PlanAsyncServicesTestCase(TransactionTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def tearDown(self):
+        cache.clear()
+
+    def create(self, payload):
+        request = self.factory.post(
+            '/plans/create/', data=payload, content_type=self.content_type)
+        return async_to_sync(async_services.create)(request)
+
+    def test_views_are_coroutines(self):
+        for view in [async_services.create, async_services.update,
+                     async_services.delete, async_services.list]:
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+            self.assertTrue(view.csrf_exempt)
+
+    def test_create_plan(self):
+        response = self.create(self.payload)
+
+        data = json.loads(response.content)
+        plan = Plans.objects.get(pk=data['data'][0]['id'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(plan.plan_code, 'OiPos10gb100')
+        self.assertEqual(plan.operator, 'oi')
+
+    def test_request_duplicate_plan_code(self):
+        self.create(self.payload)
+
+        response = self.create(self.payload)
+
+        self.assertContains(
+            response, '"invalid_fields": [{"plan_code": "already exists."', status_code=500)
+
+    def test_database_error_on_insert(self):
+        with mock.patch.object(helpers, 'insert_plan', side_effect=DatabaseError('numeric field overflow')):
+            response = self.create(self.payload)
+
+        self.assertContains(
+            response, '"message": "Internal Server Error."', status_code=500)
+
+    def test_update_plan(self):
+        plan_id = json.loads(self.create(self.payload).content)['data'][0]['id']
+
+        request = self.factory.put(
+            '/plans/update/%d' % plan_id, data={'price': '19.90', 'ddds': [11]},
+            content_type=self.content_type)
+        response = async_to_sync(async_services.update)(request, plan_id)
+
+        plan = Plans.objects.get(pk=plan_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(str(plan.price), '19.90')
+        self.assertEqual(plan.ddds, [11])
+
+    def test_delete_plan(self):
+        plan_id = json.loads(self.create(self.payload).content)['data'][0]['id']
+
+        request = self.factory.post('/plans/delete/%d' % plan_id)
+        response = async_to_sync(async_services.delete)(request, plan_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Plans.objects.filter(pk=plan_id).exists())
+
+    def test_plan_not_found(self):
+        request = self.factory.post('/plans/delete/1')
+        response = async_to_sync(async_services.delete)(request, 1)
+
+        self.assertContains(response, '"code": 404', status_code=404)
+
+    def test_list_plans(self):
+        self.create(self.payload)
+        self.create(dict(self.payload, plan_code='Tim1', operator='Tim', ddds=[11]))
+
+        request = self.factory.get('/plans/?ddds=[21]')
+        response = async_to_sync(async_services.list)(request)
+
+        self.assertContains(response, '"total": 1')
+        self.assertContains(response, '"plan_code": "OiPos10gb100"')
+        self.assertTrue(response['ETag'])
+
+        request = self.factory.get('/plans/?ddds=[21]', HTTP_IF_NONE_MATCH=response['ETag'])
+        response = async_to_sync(async_services.list)(request)
+
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(PLANS_TIMING_SAMPLE_RATE=1.0)
+    def test_server_timing_under_async_views(self):
+        self.create(self.payload)
+
+        request = self.factory.get('/plans/?ddds=[21]')
+        request.resolver_match = resolve('/plans/')
+        middleware = server_timing_middleware(async_services.list)
+
+        with self.assertLogs('plans.timing', 'INFO'):
+            response = async_to_sync(middleware)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    @override_settings(PLANS_TIMING_SAMPLE_RATE=1.0)
+    def test_server_timing_of_sync_views_under_asgi(self):
+        from wooza import asgi
+
+        plan_id = json.loads(self.create(self.payload).content)['data'][0]['id']
+
+        async def run():
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': '/plans/batch',
+                'root_path': '',
+                'query_string': b'ids=%d' % plan_id,
+                'headers': [(b'host', b'testserver')],
+            }
+            await asgi.application(scope, receive, send)
+
+            return messages
+
+        with self.assertLogs('plans.timing', 'INFO'):
+            messages = async_to_sync(run)()
+
+        headers = dict(messages[0]['headers'])
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn(b'desc="1 queries"', headers[b'Server-Timing'])
+
+
+class PlanUpsertTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def test_request_invalid(self):
+        response = self.client.get(reverse('upsert', args=['OiPos10gb100']))
+
+        self.assertContains(
+            response,
+            b'{"error": {"code": 400, "message": "Bad Request."}}',
+            status_code=400)
+
+    def test_request_with_missing_field(self):
+        payload = dict(self.payload)
+        del payload['price']
+
+        response = self.client.put(
+            reverse('upsert', args=['OiPos10gb100']), data=payload,
+            content_type=self.content_type)
+
+        self.assertContains(
+            response, '"invalid_fields": [{"price": "is required."', status_code=400)
+
+    def test_upsert_creates_plan(self):
+        response = self.client.put(
+            reverse('upsert', args=['OiPos10gb100']), data=self.payload,
+            content_type=self.content_type)
+
+        data = json.loads(response.content)
+        plan = Plans.objects.get(plan_code='OiPos10gb100')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['created'])
+        self.assertEqual(data['data'][0]['id'], plan.id)
+        self.assertEqual(plan.operator, 'oi')
+
+    def test_upsert_updates_plan(self):
+        self.client.put(
+            reverse('upsert', args=['OiPos10gb100']), data=self.payload,
+            content_type=self.content_type)
+        self.client.get('/plans/?ddds=[21]')
+
+        payload = dict(self.payload, price='19.90', ddds=[11])
+        response = self.client.put(
+            reverse('upsert', args=['OiPos10gb100']), data=payload,
+            content_type=self.content_type)
+
+        data = json.loads(response.content)
+        plan = Plans.objects.get(plan_code='OiPos10gb100')
+
+        self.assertFalse(data['created'])
+        self.assertEqual(data['data'][0]['price'], '19.90')
+        self.assertEqual(str(plan.price), '19.90')
+        self.assertEqual(plan.ddds, [11])
+        self.assertEqual(Plans.objects.count(), 1)
+        self.assertContains(self.client.get('/plans/?ddds=[21]'), '"total": 0', status_code=404)
+
+
+class PlanConcurrentWritesTestCase(TransactionTestCase):
+    workers = 16
+
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def tearDown(self):
+        cache.clear()
+
+    def run_in_parallel(self, request):
+        barrier = threading.Barrier(self.workers)
+        responses = []
+
+        def worker():
+            client = Client()
+            barrier.wait()
+            try:
+                responses.append(request(client))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return responses
+
+    def test_parallel_creates_with_the_same_code(self):
+        responses = self.run_in_parallel(
+            lambda client: client.post(
+                reverse('create'), data=self.payload, content_type=self.content_type))
+
+        status_codes = sorted(response.status_code for response in responses)
+
+        self.assertEqual(status_codes, [200] + [500] * (self.workers - 1))
+        self.assertEqual(Plans.objects.filter(plan_code='OiPos10gb100').count(), 1)
+
+    def test_parallel_upserts_with_the_same_code(self):
+        responses = self.run_in_parallel(
+            lambda client: client.put(
+                reverse('upsert', args=['OiPos10gb100']), data=self.payload,
+                content_type=self.content_type))
+
+        created = [json.loads(response.content)['created'] for response in responses]
+
+        self.assertEqual(created.count(True), 1)
+        self.assertEqual(Plans.objects.filter(plan_code='OiPos10gb100').count(), 1)
+
+
+class PlanServerTimingTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    @override_settings(PLANS_TIMING_SAMPLE_RATE=1.0)
+    def test_sampled_request_reports_timings(self):
+        with self.assertLogs('plans.timing', 'INFO') as logs:
+            response = self.client.get('/plans/?ddds=[21]')
+
+        record = json.loads(logs.records[0].getMessage())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIn('view;dur=', response['Server-Timing'])
+        self.assertEqual(record['path'], '/plans/')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['queries'], 2)
+        self.assertGreater(record['db_ms'], 0)
+
+    @override_settings(PLANS_TIMING_SAMPLE_RATE=0.0)
+    def test_unsampled_request_is_left_alone(self):
+        response = self.client.get('/plans/?ddds=[21]')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class PlanSerializationTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def test_row_and_model_serialize_alike(self):
+        plan = Plans.objects.get(plan_code='OiPos10gb100')
+        row = Plans.objects.values_list(*helpers.PLAN_FIELDS).get(pk=plan.id)
+
+        self.assertEqual(helpers.serialize_row(row), helpers.serialize_plan(plan))
+        self.assertEqual(helpers.serialize_row(row)['price'], '29.75')
+
+    @override_settings(PLANS_JSON_DUMPS='plans.tests.compact_dumps')
+    def test_pluggable_json_dumps(self):
+        response = self.client.get('/plans/?ddds=[21]')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/json')
+        self.assertContains(response, '"total":1')
+        self.assertContains(response, '"price":"29.75"')
+
+
+class PlanFieldsTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        for plan_code, price in [('Oi1', '19.90'), ('Oi2', '29.90')]:
+            payload = dict(self.payload, plan_code=plan_code, price=price)
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/plans/?ddds=[21]&fields=plan_code,price')
+
+        data = json.loads(response.content)
+        select = [query['sql'] for query in queries if 'plans_plans' in query['sql']][0]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(data['data'], key=lambda plan: plan['plan_code']),
+            [{'plan_code': 'Oi1', 'price': '19.90'}, {'plan_code': 'Oi2', 'price': '29.90'}])
+        self.assertNotIn('"ddds"', select.split('FROM')[0])
+
+    def test_sparse_fields_with_pagination(self):
+        path = '/plans/?ddds=[21]&fields=plan_code&limit=1'
+        first = json.loads(self.client.get(path).content)
+
+        response = self.client.get(path + '&cursor=' + first['next_cursor'])
+
+        data = json.loads(response.content)
+
+        self.assertEqual(first['data'], [{'plan_code': 'Oi1'}])
+        self.assertEqual(data['data'], [{'plan_code': 'Oi2'}])
+
+    def test_invalid_field(self):
+        response = self.client.get('/plans/?ddds=[21]&fields=plan_code,password')
+
+        self.assertContains(
+            response,
+            '"invalid_fields": [{"fields": "password is not a valid field."',
+            status_code=400)
+
+    def test_sparse_fields_on_export(self):
+        response = self.client.get(reverse('export') + '?fields=plan_code')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(
+            sorted(json.loads(line)['plan_code'] for line in lines), ['Oi1', 'Oi2'])
+        self.assertEqual(json.loads(lines[0]).keys(), {'plan_code'})
+
+
+@ddt
+class PlanRangeFiltersTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        for plan_code, price, minutes in [('Oi1', '19.90', 300), ('Oi2', '49.90', 100), ('Oi3', '79.90', 200)]:
+            payload = dict(self.payload, plan_code=plan_code, price=price, minutes=minutes)
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def plan_codes(self, path):
+        response = self.client.get('/plans/?ddds=[21]&' + path)
+        return [plan['plan_code'] for plan in json.loads(response.content)['data']]
+
+    @data(
+        ('price_max=50&order_by=price', ['Oi1', 'Oi2']),
+        ('price_min=20&price_max=80&order_by=-price', ['Oi3', 'Oi2']),
+        ('minutes_min=150&order_by=minutes', ['Oi3', 'Oi1']),
+        ('minutes_max=200&order_by=-price', ['Oi3', 'Oi2']),
+    )
+    @unpack
+    def test_filters_and_ordering(self, path, plan_codes):
+        self.assertEqual(self.plan_codes(path), plan_codes)
+
+    @data(
+        ('order_by=price', ['Oi1', 'Oi2', 'Oi3']),
+        ('order_by=-price', ['Oi3', 'Oi2', 'Oi1']),
+        ('order_by=minutes', ['Oi2', 'Oi3', 'Oi1']),
+    )
+    @unpack
+    def test_pagination_follows_ordering(self, path, plan_codes):
+        path = '/plans/?ddds=[21]&limit=1&fields=plan_code&' + path
+        result = []
+
+        data = json.loads(self.client.get(path).content)
+        result += [plan['plan_code'] for plan in data['data']]
+        while data['next_cursor']:
+            data = json.loads(self.client.get(path + '&cursor=' + data['next_cursor']).content)
+            result += [plan['plan_code'] for plan in data['data']]
+
+        self.assertEqual(result, plan_codes)
+
+    @data(
+        ('price_min=abc', {'price_min': 'is not a valid number.'}),
+        ('price_max=NaN', {'price_max': 'is not a valid number.'}),
+        ('minutes_min=1.5', {'minutes_min': 'is not a valid number.'}),
+        ('price_min=50&price_max=20', {'price_min': 'must not be greater than price_max.'}),
+        ('order_by=internet', {'order_by': 'is not a valid choice.'}),
+    )
+    @unpack
+    def test_invalid_filters(self, path, invalid_field):
+        response = self.client.get('/plans/?ddds=[21]&' + path)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error']['invalid_fields'], [invalid_field])
+
+    @data('price_max=50', 'minutes_min=150')
+    def test_ranges_require_ddds(self, path):
+        response = self.client.get('/plans/?' + path)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content)['error']['invalid_fields'],
+            [{path.split('=')[0]: 'requires ddds.'}])
+
+
+@ddt
+class PlanCodeSearchTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        for plan_code in ['OiPos10gb100', 'OiPos20gb200', 'OiControle10gb', 'TimPos10gb100']:
+            payload = dict(self.payload, plan_code=plan_code)
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+    def tearDown(self):
+        Plans.objects.all().delete()
+        cache.clear()
+
+    def plan_codes(self, path):
+        response = self.client.get('/plans/?' + path)
+        return [plan['plan_code'] for plan in json.loads(response.content)['data']]
+
+    def test_prefix(self):
+        plan_codes = self.plan_codes('plan_code_search=OiPos')
+
+        self.assertEqual(plan_codes, ['OiPos10gb100', 'OiPos20gb200'])
+
+    def test_prefix_with_ddds(self):
+        plan_codes = self.plan_codes('ddds=[21]&plan_code_search=OiPos&search_limit=1')
+
+        self.assertEqual(plan_codes, ['OiPos10gb100'])
+
+    def test_similarity(self):
+        plan_codes = self.plan_codes('plan_code_search=OiPos10gb10&search_mode=similarity')
+
+        self.assertEqual(plan_codes[0], 'OiPos10gb100')
+        self.assertNotIn('OiControle10gb', plan_codes[:2])
+
+    @data(
+        ('plan_code_search=', {'plan_code_search': 'is empty.'}),
+        ('plan_code_search=Oi&search_mode=regex', {'search_mode': 'is not a valid choice.'}),
+        ('plan_code_search=Oi&search_limit=500', {'search_limit': 'must be between 1 and 100.'}),
+        ('plan_code_search=Oi&limit=10', {'limit': 'cannot be combined with plan_code_search.'}),
+        ('search_mode=prefix', {'search_mode': 'requires plan_code_search.'}),
+    )
+    @unpack
+    def test_invalid_search(self, path, invalid_field):
+        response = self.client.get('/plans/?' + path)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error']['invalid_fields'], [invalid_field])
+
+
+class PlanStatsTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        plans = [
+            ('Oi1', 'Oi', '20.00', 100, [21, 22]),
+            ('Oi2', 'Oi', '40.00', 300, [21]),
+            ('Tim1', 'Tim', '30.00', 200, [21]),
+        ]
+        for plan_code, operator, price, minutes, ddds in plans:
+            payload = dict(
+                self.payload, plan_code=plan_code, operator=operator, price=price,
+                minutes=minutes, ddds=ddds)
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+        stats.refresh()
+
+    def test_stats_per_ddd_and_operator(self):
+        response = self.client.get(reverse('plan_stats') + '?ddd=21')
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['data'][0], {
+            'ddd': 21,
+            'operator': 'oi',
+            'plan_type': 'pós',
+            'plans': 2,
+            'min_price': '20.00',
+            'avg_price': '30.00',
+            'max_price': '40.00',
+            'min_minutes': 100,
+            'avg_minutes': '200.00',
+            'max_minutes': 300
+        })
+        self.assertEqual(data['data'][1]['operator'], 'tim')
+
+    def test_stats_filtered_by_operator(self):
+        response = self.client.get(reverse('plan_stats') + '?operator=Oi')
+
+        data = json.loads(response.content)
+
+        self.assertEqual([(row['ddd'], row['plans']) for row in data['data']], [(21, 2), (22, 1)])
+
+    def test_stats_not_found(self):
+        response = self.client.get(reverse('plan_stats') + '?ddd=11')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_ddd(self):
+        response = self.client.get(reverse('plan_stats') + '?ddd=10')
+
+        self.assertContains(
+            response, '"invalid_fields": [{"ddd": "is not a valid choice."}]', status_code=400)
+
+
+class PlanStatsRefreshTestCase(TransactionTestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def tearDown(self):
+        cache.clear()
+        stats.refresh()
+
+    def test_refresh_after_commit(self):
+        with mock.patch.object(stats, 'REFRESH_DELAY', 0):
+            self.client.post(
+                reverse('create'), data=self.payload, content_type=self.content_type)
+
+        response = self.client.get(reverse('plan_stats') + '?ddd=22')
+
+        self.assertContains(response, '"plans": 1')
+
+    def test_writes_share_one_refresh(self):
+        with mock.patch.object(stats, 'REFRESH_DELAY', 60):
+            self.client.post(
+                reverse('create'), data=self.payload, content_type=self.content_type)
+            timer = stats._timer
+
+            payload = dict(self.payload, plan_code='OiPos20gb200')
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+        shared_timer = stats._timer
+        timer.cancel()
+        stats._timer = None
+
+        self.assertIsNotNone(timer)
+        self.assertIs(shared_timer, timer)
+        self.assertEqual(Plans.objects.count(), 2)
+
+
+@ddt
+class PlanCheapestTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        plans = [
+            ('Oi1', 'Oi', 'Pós', '30.00', [21]),
+            ('Oi2', 'Oi', 'Pré', '10.00', [21]),
+            ('Oi3', 'Oi', 'Pós', '20.00', [21, 22]),
+            ('Tim1', 'Tim', 'Pós', '50.00', [21]),
+            ('Tim2', 'Tim', 'Controle', '15.00', [22]),
+        ]
+        for plan_code, operator, plan_type, price, ddds in plans:
+            payload = dict(
+                self.payload, plan_code=plan_code, operator=operator,
+                plan_type=plan_type, price=price, ddds=ddds)
+            self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+
+    def plan_codes(self, path):
+        response = self.client.get(reverse('cheapest') + '?' + path)
+        return [plan['plan_code'] for plan in json.loads(response.content)['data']]
+
+    @data(
+        ('ddd=21', ['Oi2', 'Oi3', 'Oi1', 'Tim1']),
+        ('ddd=21&n=2', ['Oi2', 'Oi3', 'Tim1']),
+        ('ddd=21&n=1&per=plan_type', ['Oi3', 'Oi2']),
+        ('ddd=22&n=1', ['Oi3', 'Tim2']),
+    )
+    @unpack
+    def test_cheapest_per_group(self, path, plan_codes):
+        self.assertCountEqual(self.plan_codes(path), plan_codes)
+
+    def test_cheapest_ordered_by_group_and_price(self):
+        self.assertEqual(self.plan_codes('ddd=21'), ['Oi2', 'Oi3', 'Oi1', 'Tim1'])
+
+    def test_cheapest_runs_one_query(self):
+        with self.assertNumQueries(1):
+            helpers.cheapest_plans(21, limit=1)
+
+    def test_cheapest_not_found(self):
+        response = self.client.get(reverse('cheapest') + '?ddd=11')
+
+        self.assertEqual(response.status_code, 404)
+
+    @data(
+        ('', {'ddd': 'is required.'}),
+        ('ddd=abc', {'ddd': 'is not a valid number.'}),
+        ('ddd=21&per=internet', {'per': 'is not a valid choice.'}),
+        ('ddd=21&n=50', {'n': 'must be between 1 and 20.'}),
+    )
+    @unpack
+    def test_invalid_query(self, path, invalid_field):
+        response = self.client.get(reverse('cheapest') + '?' + path)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error']['invalid_fields'], [invalid_field])
+
+
+@ddt
+class PlanPayloadValidatorTestCase(TestCase):
+    def setUp(self):
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def test_batch_returns_errors_per_row(self):
+        payloads = [
+            self.payload,
+            dict(self.payload, ddds=[21, 23, 25]),
+            {'plan_code': 'Oi1'},
+            'OiPos10gb100',
+            dict(self.payload, minutes='100a', plan_type='Limitado'),
+        ]
+
+        errors = helpers.PAYLOAD_VALIDATOR.validate_batch(payloads)
+
+        self.assertEqual(errors[1], [{'ddds': 'is not a valid choice.'}])
+        self.assertEqual(errors[2][0], {'minutes': 'is required.'})
+        self.assertEqual(errors[3], [{'row': 'is not an object.'}])
+        self.assertEqual(
+            errors[4],
+            [{'minutes': 'is not a valid number.'}, {'plan_type': 'is not a valid choice.'}])
+        self.assertNotIn(0, errors)
+
+    def test_partial_batch(self):
+        errors = helpers.PAYLOAD_VALIDATOR.validate_batch(
+            [{'price': '19.90'}, {'price': '', 'ddds': [10]}], partial=True)
+
+        self.assertEqual(errors, {1: [{'price': 'is empty.'}, {'ddds': 'is not a valid choice.'}]})
+
+    @data(
+        ('minutes', [100]),
+        ('price', {'value': 1}),
+        ('plan_type', ['Pós']),
+        ('ddds', [[21]]),
+        ('ddds', 21),
+        ('ddds', {21: 'a'}),
+        ('minutes', 2 ** 31),
+        ('minutes', float('inf')),
+        ('price', '9999.999'),
+        ('price', 'NaN'),
+        ('price', '1e30'),
+        ('price', 1e30),
+        ('plan_code', ['x']),
+        ('plan_code', 123),
+        ('internet', '1' * 11),
+    )
+    @unpack
+    def test_malformed_values_are_invalid(self, field, value):
+        invalid_fields = helpers.validates_payload(dict(self.payload, **{field: value}))
+
+        self.assertEqual([list(error.keys()) for error in invalid_fields], [[field]])
+
+
+@ddt
+class PlanBatchTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        self.ids = []
+        for plan_code in ['Oi1', 'Oi2', 'Oi3']:
+            response = self.client.post(
+                reverse('create'), data=dict(self.payload, plan_code=plan_code),
+                content_type=self.content_type)
+            self.ids.append(json.loads(response.content)['data'][0]['id'])
+
+    def test_batch_by_ids(self):
+        ids = [self.ids[2], 999999, self.ids[0]]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('batch') + '?ids=' + ','.join(str(plan_id) for plan_id in ids))
+
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi3', 'Oi1'])
+        self.assertEqual(data['missing'], [999999])
+        self.assertEqual(data['total'], 2)
+
+    def test_batch_by_plan_codes(self):
+        response = self.client.get(reverse('batch') + '?plan_codes=Oi2,Tim1,Oi1&fields=plan_code')
+
+        data = json.loads(response.content)
+
+        self.assertEqual(data['data'], [{'plan_code': 'Oi2'}, {'plan_code': 'Oi1'}])
+        self.assertEqual(data['missing'], ['Tim1'])
+
+    def test_batch_not_found(self):
+        response = self.client.get(reverse('batch') + '?plan_codes=Tim1')
+
+        self.assertContains(response, '"missing": ["Tim1"]', status_code=404)
+
+    @data(
+        ('', {'ids': 'either ids or plan_codes is required.'}),
+        ('ids=1&plan_codes=Oi1', {'ids': 'either ids or plan_codes is required.'}),
+        ('ids=1,a', {'ids': 'is not a valid list of numbers.'}),
+        ('ids=1,²', {'ids': 'is not a valid list of numbers.'}),
+        ('ids=1,-2', {'ids': 'is not a valid list of numbers.'}),
+        ('plan_codes=,', {'plan_codes': 'is empty.'}),
+        ('ids=' + ','.join(str(plan_id) for plan_id in range(101)),
+         {'ids': 'must have at most 100 values.'}),
+    )
+    @unpack
+    def test_invalid_query(self, path, invalid_field):
+        response = self.client.get(reverse('batch') + '?' + path)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['error']['invalid_fields'], [invalid_field])
+
+
+class PlanChangesTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        response = self.client.get(reverse('changes'))
+        self.since = json.loads(response.content)['next_since']
+
+    def tearDown(self):
+        cache.clear()
+
+    def create(self, plan_code):
+        response = self.client.post(
+            reverse('create'), data=dict(self.payload, plan_code=plan_code),
+            content_type=self.content_type)
+        return json.loads(response.content)['data'][0]['id']
+
+    def changes(self, since, limit=100):
+        response = self.client.get(reverse('changes') + '?since=%d&limit=%d' % (since, limit))
+        return json.loads(response.content)
+
+    def test_changes_follow_writes(self):
+        first_id = self.create('Oi1')
+        second_id = self.create('Oi2')
+        self.client.put(
+            reverse('update', args=[first_id]), data={'price': '19.90'},
+            content_type=self.content_type)
+        self.client.post(reverse('delete', args=[second_id]))
+
+        data = self.changes(self.since)
+
+        self.assertEqual(
+            [(change['action'], change['plan']['plan_code']) for change in data['data']],
+            [('upsert', 'Oi1'), ('delete', 'Oi2')])
+        self.assertEqual(data['data'][0]['plan']['price'], '19.90')
+        self.assertEqual(data['next_since'], data['data'][-1]['revision'])
+        self.assertFalse(data['has_more'])
+
+    def test_raw_sql_writes_are_tracked(self):
+        self.create('Oi1')
+        self.client.put(
+            reverse('upsert', args=['Oi1']), data=dict(self.payload, price='9.90'),
+            content_type=self.content_type)
+
+        data = self.changes(self.since)
+
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['data'][0]['plan']['price'], '9.90')
+
+    def test_changes_are_paged_by_revision(self):
+        for plan_code in ['Oi1', 'Oi2', 'Oi3']:
+            self.create(plan_code)
+
+        first = self.changes(self.since, limit=2)
+        second = self.changes(first['next_since'], limit=2)
+
+        self.assertTrue(first['has_more'])
+        self.assertEqual([change['plan']['plan_code'] for change in first['data']], ['Oi1', 'Oi2'])
+        self.assertEqual([change['plan']['plan_code'] for change in second['data']], ['Oi3'])
+        self.assertFalse(second['has_more'])
+
+    def test_no_changes(self):
+        data = self.changes(self.since)
+
+        self.assertEqual(data['data'], [])
+        self.assertEqual(data['next_since'], self.since)
+
+    def test_invalid_since(self):
+        for since in ['-1', '²']:
+            response = self.client.get(reverse('changes') + '?since=' + since)
+
+            self.assertContains(
+                response, '"invalid_fields": [{"since": "is not a valid revision."}]', status_code=400)
+
+
+class PlanRevisionLockTestCase(TransactionTestCase):
+    def setUp(self):
+        self.first, self.second = [
+            Plans.objects.create(
+                plan_code=plan_code, minutes=100, internet='10GB', price='29.75',
+                plan_type='Pós', operator='oi', ddds=[21]).id
+            for plan_code in ['Oi1', 'Oi2']]
+
+    def tearDown(self):
+        cache.clear()
+
+    def waiting_on_locks(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM pg_locks WHERE NOT granted')
+            return cursor.fetchone()[0]
+
+    def test_writer_sharing_a_row_waits_instead_of_deadlocking(self):
+        started = threading.Event()
+        errors = []
+
+        def writer():
+            started.wait()
+            try:
+                Plans.objects.filter(pk=self.second).update(minutes=200)
+            except DatabaseError as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+
+        try:
+            with transaction.atomic():
+                Plans.objects.filter(pk=self.first).update(minutes=300)
+                started.set()
+
+                deadline = time.monotonic() + 5
+                while not self.waiting_on_locks() and time.monotonic() < deadline:
+                    time.sleep(0.01)
+
+                Plans.objects.filter(pk=self.second).update(minutes=300)
+        finally:
+            started.set()
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Plans.objects.get(pk=self.second).minutes, 200)
+
+
+class PlanEventsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+    def tearDown(self):
+        cache.clear()
+
+    def stream(self, query_string, write, count):
+        async def run():
+            disconnect = asyncio.Event()
+            messages = asyncio.Queue()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                await messages.put(message)
+
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': events.EVENTS_PATH,
+                'query_string': query_string.encode()
+            }
+            task = asyncio.ensure_future(events.stream(scope, receive, send))
+
+            start = await messages.get()
+            if start['status'] != 200:
+                return (start, [(await messages.get())['body']])
+
+            await messages.get()
+            await sync_to_async(write)()
+
+            bodies = []
+            for _ in range(count):
+                bodies.append((await asyncio.wait_for(messages.get(), 5))['body'])
+
+            disconnect.set()
+            await task
+
+            return (start, bodies)
+
+        return async_to_sync(run)()
+
+    def test_streams_writes(self):
+        def write():
+            response = self.client.post(
+                reverse('create'), data=self.payload, content_type=self.content_type)
+            plan_id = json.loads(response.content)['data'][0]['id']
+            self.client.put(
+                reverse('update', args=[plan_id]), data={'price': '19.90'},
+                content_type=self.content_type)
+            self.client.post(reverse('delete', args=[plan_id]))
+
+        start, bodies = self.stream('', write, 3)
+
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual(
+            [body.split(b'\n')[1] for body in bodies],
+            [b'event: create', b'event: update', b'event: delete'])
+        self.assertIn(b'"plan_code":"OiPos10gb100"', bodies[0])
+
+    def test_filters_by_ddd_and_operator(self):
+        def write():
+            for plan_code, operator, ddds in [('Oi1', 'Oi', [11]), ('Tim1', 'Tim', [21]), ('Oi2', 'Oi', [21])]:
+                payload = dict(self.payload, plan_code=plan_code, operator=operator, ddds=ddds)
+                self.client.post(
+                    reverse('create'), data=payload, content_type=self.content_type)
+
+        start, bodies = self.stream('ddd=21&operator=Oi', write, 1)
+
+        self.assertIn(b'"plan_code":"Oi2"', bodies[0])
+
+    def test_update_out_of_the_filter_is_streamed(self):
+        response = self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+        plan_id = json.loads(response.content)['data'][0]['id']
+
+        def write():
+            self.client.put(
+                reverse('update', args=[plan_id]), data={'ddds': [11], 'operator': 'Tim'},
+                content_type=self.content_type)
+
+        start, bodies = self.stream('ddd=21&operator=Oi', write, 1)
+
+        self.assertIn(b'event: update', bodies[0])
+        self.assertIn(b'"previous":{"operator":"oi","ddds":[21,22]}', bodies[0])
+
+    def test_invalid_ddd(self):
+        start, bodies = self.stream('ddd=10', None, 0)
+
+        self.assertEqual(start['status'], 400)
+        self.assertIn(b'"ddd": "is not a valid choice."', bodies[0])
+
+    def test_slow_subscriber_overflows(self):
+        async def run():
+            subscriber = events.Subscriber(buffer_size=2)
+            for revision in range(3):
+                subscriber.publish({'revision': revision, 'operator': 'oi', 'ddds': [21]})
+            return subscriber
+
+        subscriber = async_to_sync(run)()
+
+        self.assertTrue(subscriber.overflowed)
+        self.assertEqual(subscriber.queue.qsize(), 2)
+
+    def test_dropped_listen_connection_cuts_subscribers_off(self):
+        def drop():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_terminate_backend(%s)', [events.get_broker().connection.get_backend_pid()])
+
+        start, bodies = self.stream('', drop, 1)
+
+        self.assertEqual(bodies[0], b'event: overflow\ndata: {"since": null}\n\n')
+        self.assertIsNone(events.get_broker().connection)
+
+        def write():
+            self.client.post(reverse('create'), data=self.payload, content_type=self.content_type)
+
+        start, bodies = self.stream('', write, 1)
+
+        self.assertIn(b'event: create', bodies[0])
+
+
+@ddt
+class PlanBulkUpdateDeleteTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        self.ids = {}
+        plans = [
+            ('Oi1', 'Oi', '20.00', [21]),
+            ('Oi2', 'Oi', '40.00', [21, 22]),
+            ('Oi3', 'Oi', '60.00', [11]),
+            ('Tim1', 'Tim', '30.00', [21]),
+        ]
+        for plan_code, operator, price, ddds in plans:
+            payload = dict(self.payload, plan_code=plan_code, operator=operator, price=price, ddds=ddds)
+            response = self.client.post(
+                reverse('create'), data=payload, content_type=self.content_type)
+            self.ids[plan_code] = json.loads(response.content)['data'][0]['id']
+
+    def tearDown(self):
+        cache.clear()
+
+    def post(self, name, body):
+        response = self.client.post(reverse(name), data=body, content_type=self.content_type)
+        return (response.status_code, json.loads(response.content))
+
+    def prices(self):
+        return dict(Plans.objects.values_list('plan_code', 'price'))
+
+    def test_update_by_ids(self):
+        body = {'plans': [
+            {'id': self.ids['Tim1'], 'price': '25.00'},
+            {'id': self.ids['Oi1'], 'minutes': 300, 'operator': 'Tim'},
+            {'id': 999999, 'price': '1.00'},
+        ]}
+
+        with CaptureQueriesContext(connection) as queries:
+            status_code, data = self.post('bulk_update', body)
+
+        plan = Plans.objects.get(pk=self.ids['Oi1'])
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Tim1', 'Oi1'])
+        self.assertEqual(data['missing'], [999999])
+        self.assertEqual(self.prices()['Tim1'], Decimal('25.00'))
+        self.assertEqual((plan.minutes, plan.operator, plan.price), (300, 'tim', Decimal('20.00')))
+        self.assertEqual(
+            len([query for query in queries if 'UPDATE plans_plans' in query['sql']]), 1)
+
+    def test_update_by_filter(self):
+        body = {'filter': {'ddds': [21], 'operator': 'oi'}, 'patch': {'price_percent': 5}}
+
+        status_code, data = self.post('bulk_update', body)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi1', 'Oi2'])
+        self.assertEqual(
+            self.prices(),
+            {'Oi1': Decimal('21.00'), 'Oi2': Decimal('42.00'), 'Oi3': Decimal('60.00'), 'Tim1': Decimal('30.00')})
+
+    def test_update_by_filter_past_the_price_limit(self):
+        Plans.objects.filter(pk=self.ids['Oi2']).update(price='9000.00')
+
+        body = {'filter': {'ddds': [21], 'operator': 'oi'}, 'patch': {'price_percent': 20}}
+
+        status_code, data = self.post('bulk_update', body)
+
+        self.assertEqual(status_code, 400)
+        self.assertEqual(
+            data['error']['invalid_fields'], [{'price_percent': 'must keep prices lower than 10000.'}])
+        self.assertEqual(self.prices()['Oi1'], Decimal('20.00'))
+
+    def test_update_invalidates_list_cache(self):
+        self.client.get('/plans/?ddds=[21]&operator=oi')
+
+        self.post('bulk_update', {'filter': {'ddds': [21], 'operator': 'oi'}, 'patch': {'price': '9.90'}})
+
+        response = self.client.get('/plans/?ddds=[21]&operator=oi')
+
+        self.assertContains(response, '"price": "9.90"')
+
+    def test_delete_by_ids(self):
+        status_code, data = self.post('bulk_delete', {'ids': [self.ids['Oi3'], 999999, self.ids['Oi1']]})
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi3', 'Oi1'])
+        self.assertEqual(data['missing'], [999999])
+        self.assertEqual(sorted(self.prices()), ['Oi2', 'Tim1'])
+
+    def test_delete_by_filter(self):
+        status_code, data = self.post('bulk_delete', {'filter': {'ddds': [21], 'price_max': 30}})
+
+        self.assertEqual([plan['plan_code'] for plan in data['data']], ['Oi1', 'Tim1'])
+        self.assertEqual(sorted(self.prices()), ['Oi2', 'Oi3'])
+
+    def test_delete_not_found(self):
+        status_code, data = self.post('bulk_delete', {'ids': [999999]})
+
+        self.assertEqual(status_code, 404)
+
+    @data(
+        ('bulk_update', {}, {'body': 'requires either plans or filter.'}),
+        ('bulk_update', {'filter': {'operator': 'oi'}, 'patch': {'price': '1.00'}}, {'ddds': 'is required.'}),
+        ('bulk_update', {'filter': {'ddds': [21]}, 'patch': {'plan_code': 'Oi9'}}, {'plan_code': 'cannot be changed in bulk.'}),
+        ('bulk_update', {'filter': {'ddds': [21]}, 'patch': {'price_percent': 'abc'}}, {'price_percent': 'is not a valid percentage.'}),
+        ('bulk_update', {'plans': [{'id': 1, 'price': '1.00'}, {'id': 1, 'price': '2.00'}]}, {'plans': 'has duplicated ids.'}),
+        ('bulk_update', {'plans': [{'id': 1, 'price': '1.00'}, {'id': 2, 'ddds': [10]}]}, {'row': 1, 'invalid_fields': [{'ddds': 'is not a valid choice.'}]}),
+        ('bulk_delete', {'ids': ['1']}, {'ids': 'is not a valid list of ids.'}),
+        ('bulk_delete', {'ids': [2 ** 31]}, {'ids': 'is not a valid list of ids.'}),
+        ('bulk_update', {'plans': [{'id': 1099511627776, 'price': '1.00'}]}, {'plans': 'is not a valid list of ids.'}),
+        ('bulk_delete', {'filter': {'ddds': [21], 'color': 'red'}}, {'filter': 'color is not a valid filter.'}),
+    )
+    @unpack
+    def test_invalid_body(self, name, body, invalid_field):
+        status_code, data = self.post(name, body)
+
+        self.assertEqual(status_code, 400)
+        self.assertEqual(data['error']['invalid_fields'], [invalid_field])
+        self.assertEqual(Plans.objects.count(), 4)
+
+
+class PlanSingleStatementWritesTestCase(TestCase):
+    def setUp(self):
+        self.content_type = 'application/json'
+        self.payload = {
+            'plan_code': 'OiPos10gb100',
+            'minutes': 100,
+            'internet': '10GB',
+            'price': '29.75',
+            'plan_type': 'Pós',
+            'operator': 'Oi',
+            'ddds': [21, 22]
+        }
+
+        response = self.client.post(
+            reverse('create'), data=self.payload, content_type=self.content_type)
+        self.plan_id = json.loads(response.content)['data'][0]['id']
+
+    def tearDown(self):
+        cache.clear()
+
+    def plan_queries(self, queries):
+        return [query['sql'] for query in queries if 'plans_plans' in query['sql']]
+
+    def test_update_writes_only_the_patched_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(
+                reverse('update', args=[self.plan_id]), data={'minutes': 300},
+                content_type=self.content_type)
+
+        statements = self.plan_queries(queries)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('SET minutes = ', statements[0])
+        self.assertNotIn('price = ', statements[0])
+        self.assertEqual(json.loads(response.content)['data'][0]['price'], '29.75')
+
+    def test_duplicated_code_is_rejected_by_the_update(self):
+        Plans.objects.create(
+            plan_code='Oi2', minutes=100, internet='10GB', price='19.90',
+            plan_type='pós', operator='oi', ddds=[21])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(
+                reverse('update', args=[self.plan_id]), data={'plan_code': 'Oi2'},
+                content_type=self.content_type)
+
+        statements = self.plan_queries(queries)
+
+        self.assertContains(
+            response, '"invalid_fields": [{"plan_code": "already exists."', status_code=500)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].strip().startswith('UPDATE'))
+        self.assertEqual(Plans.objects.get(pk=self.plan_id).plan_code, 'OiPos10gb100')
+
+    def test_empty_update_writes_nothing(self):
+        version = helpers.get_catalog_version()
+
+        response = self.client.put(
+            reverse('update', args=[self.plan_id]), data={}, content_type=self.content_type)
+
+        self.assertContains(response, '"plan_code": "OiPos10gb100"')
+        self.assertEqual(helpers.get_catalog_version(), version)
+
+    def test_partial_updates_keep_other_columns(self):
+        Plans.objects.filter(pk=self.plan_id).update(price='19.90')
+
+        self.client.put(
+            reverse('update', args=[self.plan_id]), data={'minutes': 300},
+            content_type=self.content_type)
+
+        plan = Plans.objects.get(pk=self.plan_id)
+
+        self.assertEqual((plan.minutes, str(plan.price)), (300, '19.90'))
+
+    def test_update_moves_cache_buckets(self):
+        self.client.get('/plans/?ddds=[11]')
+
+        self.client.put(
+            reverse('update', args=[self.plan_id]), data={'ddds': [11]},
+            content_type=self.content_type)
+
+        response = self.client.get('/plans/?ddds=[11]')
+
+        self.assertContains(response, '"total": 1')
+
+    def test_delete_is_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('delete', args=[self.plan_id]))
+
+        statements = self.plan_queries(queries)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('DELETE'))
+        self.assertContains(response, '"plan_code": "OiPos10gb100"')
+        self.assertFalse(Plans.objects.filter(pk=self.plan_id).exists())
+
+
+@ddt
+class PlanDddsBitsetTestCase(TestCase):
+    def setUp(self):
+        plans = [
+            ('ClaroPre1', [11, 21]),
+            ('ClaroPre2', [21, 99]),
+            ('ClaroPre3', [98, 99]),
+            ('ClaroPre4', [11, 21, 98, 99]),
+        ]
+
+        for plan_code, ddds in plans:
+            Plans.objects.create(
+                plan_code=plan_code, minutes=100, internet='5GB', price='10.00',
+                plan_type='pre', operator='claro', ddds=ddds)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_masks_follow_ddds(self):
+        plan = Plans.objects.get(plan_code='ClaroPre4')
+
+        self.assertEqual((plan.ddds_low, plan.ddds_high), helpers.ddds_masks(plan.ddds))
+
+        Plans.objects.filter(pk=plan.pk).update(ddds=[99])
+        plan.refresh_from_db()
+
+        self.assertEqual((plan.ddds_low, plan.ddds_high), (0, 1 << (66 - 63)))
+
+    def test_masks_positions(self):
+        self.assertEqual(helpers.ddds_masks([11]), (1, 0))
+        self.assertEqual(helpers.ddds_masks([11, 99]), (1, 1 << 3))
+        self.assertEqual(helpers.ddds_masks([]), (0, 0))
+
+    @data(
+        ([21], 'all'), ([21, 99], 'all'), ([11, 98], 'all'), ([], 'all'),
+        ([10], 'all'), ([21, 10], 'all'), ([11, 98], 'any'), ([99], 'any'),
+        ([10], 'any'), ([10, 11], 'any'),
+    )
+    @unpack
+    def test_bitset_matches_array(self, ddds, match):
+        codes = {}
+
+        for lookup in ('array', 'bitset'):
+            with mock.patch.object(helpers, 'DDDS_LOOKUP', lookup):
+                codes[lookup] = sorted(Plans.objects.filter(
+                    helpers.ddds_lookup(ddds, match)).values_list('plan_code', flat=True))
+
+        self.assertEqual(codes['array'], codes['bitset'])
+
+    def test_list_uses_bitset(self):
+        with mock.patch.object(helpers, 'DDDS_LOOKUP', 'bitset'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/plans/?ddds=[21, 99]')
+
+        self.assertContains(response, '"total": 2')
+        self.assertTrue(any('"ddds_high" &' in query['sql'] for query in queries))
+
+
+@ddt
+class PlanDddMatchTestCase(TestCase):
+    def setUp(self):
+        plans = [
+            ('TimPre1', [11, 21]),
+            ('TimPre2', [21, 31]),
+            ('TimPre3', [41]),
+        ]
+
+        for plan_code, ddds in plans:
+            Plans.objects.create(
+                plan_code=plan_code, minutes=100, internet='5GB', price='10.00',
+                plan_type='pre', operator='tim', ddds=ddds)
+
+    def tearDown(self):
+        cache.clear()
+
+    def plan_codes(self, path):
+        response = self.client.get('/plans/?' + path)
+        return sorted(plan['plan_code'] for plan in json.loads(response.content)['data'])
+
+    @data(
+        ('ddds=[11, 31]&ddd_match=any', ['TimPre1', 'TimPre2']),
+        ('ddds=[21,41]&ddd_match=any', ['TimPre1', 'TimPre2', 'TimPre3']),
+        ('ddds=[11,21]&ddd_match=all', ['TimPre1']),
+        ('ddds=[11,21]', ['TimPre1']),
+    )
+    @unpack
+    def test_ddd_match(self, path, plan_codes):
+        self.assertEqual(self.plan_codes(path), plan_codes)
+
+    @data('array', 'bitset')
+    def test_ddd_match_any_lookups(self, lookup):
+        with mock.patch.object(helpers, 'DDDS_LOOKUP', lookup):
+            self.assertEqual(
+                self.plan_codes('ddds=[31, 41]&ddd_match=any'), ['TimPre2', 'TimPre3'])
+
+    def test_ddd_match_any_uses_overlap(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/plans/?ddds=[11, 31]&ddd_match=any')
+
+        self.assertTrue(any('&&' in query['sql'] for query in queries))
+
+    def test_ddd_match_in_export(self):
+        response = self.client.get(reverse('export') + '?ddds=[11,41]&ddd_match=any')
+        content = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(len(content.splitlines()), 2)
+
+    def test_ddd_match_in_bulk_delete(self):
+        response = self.client.post(
+            reverse('bulk_delete'), data={'filter': {'ddds': [11, 41], 'ddd_match': 'any'}},
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Plans.objects.values_list('plan_code', flat=True)), ['TimPre2'])
+
+    @data(
+        ('ddds=[21]&ddd_match=some', {'ddd_match': 'is not a valid choice.'}),
+        ('ddd_match=any', {'ddd_match': 'requires ddds.'}),
+        ('ddds=21', {'ddds': 'is not a valid list of numbers.'}),
+        ('ddds=[21,]', {'ddds': 'is not a valid list of numbers.'}),
+        ('ddds=[2a]', {'ddds': 'is not a valid list of numbers.'}),
+        ('ddds=[-21]', {'ddds': 'is not a valid list of numbers.'}),
+        ('ddds=__import__("os")', {'ddds': 'is not a valid list of numbers.'}),
+        ('ddds=[99999999999]', {'ddds': 'is not a valid list of numbers.'}),
+    )
+    @unpack
+    def test_invalid_ddds_query(self, path, error):
+        response = self.client.get('/plans/?' + path)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(error, json.loads(response.content)['error']['invalid_fields'])
+
+    @data(
+        ('[21, 22]', [21, 22]),
+        (' [ 21 ,22 ] ', [21, 22]),
+        ('[]', []),
+        ('[ ]', []),
+        ('[00]', [0]),
+        ('[2147483647]', [2147483647]),
+        ('[2147483648]', None),
+        ('[21.0]', None),
+        ('[[21]]', None),
+        ('(21, 22)', None),
+    )
+    @unpack
+    def test_parse_ddds(self, value, ddds):
+        self.assertEqual(helpers.parse_ddds(value), ddds)
+
+
+class PlanListCoalescingTestCase(TransactionTestCase):
+    workers = 16
+
+    def setUp(self):
+        Plans.objects.create(
+            plan_code='VivoPre1', minutes=100, internet='5GB', price='10.00',
+            plan_type='pre', operator='vivo', ddds=[11])
+
+        self.queries = []
+        self.list_response = helpers.list_response
+
+    def tearDown(self):
+        cache.clear()
+
+    def slow_list_response(self, queryset):
+        # Holds the first query open long enough for every request to miss.
+        def count(execute, sql, params, many, context):
+            if 'plans_plans' in sql:
+                self.queries.append(sql)
+            return execute(sql, params, many, context)
+
+        time.sleep(0.2)
+        with connection.execute_wrapper(count):
+            return self.list_response(queryset)
+
+    def test_parallel_identical_lists_run_one_query(self):
+        barrier = threading.Barrier(self.workers)
+        responses = []
+
+        def worker():
+            client = Client()
+            barrier.wait()
+            try:
+                responses.append(client.get('/plans/?ddds=[11]&operator=vivo'))
+            finally:
+                connection.close()
+
+        with mock.patch.object(helpers, 'list_response', self.slow_list_response):
+            threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(len(responses), self.workers)
+        self.assertEqual(len(set(response.content for response in responses)), 1)
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertGreater(
+            json.loads(self.client.get(reverse('cache_stats')).content)['data']['coalesced'], 0)
+
+    def test_parallel_identical_async_lists_run_one_query(self):
+        async def fire():
+            requests = [
+                RequestFactory().get('/plans/?operator=Vivo&ddds=[11]')
+                for _ in range(self.workers)]
+            return await asyncio.gather(*[async_services.list(request) for request in requests])
+
+        with mock.patch.object(helpers, 'list_response', self.slow_list_response):
+            responses = async_to_sync(fire)()
+
+        self.assertEqual(len(self.queries), 1)
+        self.assertContains(responses[-1], '"plan_code": "VivoPre1"')
+
+    def test_failed_query_is_not_shared(self):
+        def failing_list_response(queryset):
+            raise DatabaseError('boom')
+
+        with mock.patch.object(helpers, 'list_response', failing_list_response):
+            with self.assertRaises(DatabaseError):
+                self.client.get('/plans/?ddds=[11]')
+
+        self.assertContains(self.client.get('/plans/?ddds=[11]'), '"total": 1')
+
+
+class PlanAsgiExportTestCase(TransactionTestCase):
+    def setUp(self):
+        for plan_code, ddds in [('OiPos1', [21]), ('OiPos2', [21, 22]), ('OiPos3', [11])]:
+            Plans.objects.create(
+                plan_code=plan_code, minutes=100, internet='5GB', price='10.00',
+                plan_type='pós', operator='oi', ddds=ddds)
+
+    def request(self, query_string, headers=[(b'host', b'testserver')]):
+        from wooza import asgi
+
+        async def run():
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': '/plans/export',
+                'root_path': '',
+                'query_string': query_string.encode(),
+                'headers': headers,
+            }
+            await asgi.application(scope, receive, send)
+
+            return messages
+
+        return async_to_sync(run)()
+
+    def test_export_streams_under_asgi(self):
+        messages = self.request('ddds=[21]')
+
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'application/x-ndjson'), messages[0]['headers'])
+        self.assertEqual(
+            sorted(json.loads(line)['plan_code'] for line in body.splitlines()), ['OiPos1', 'OiPos2'])
+        self.assertFalse(messages[-1].get('more_body', False))
+
+    def test_invalid_export_under_asgi(self):
+        messages = self.request('format=xml')
+
+        self.assertEqual(messages[0]['status'], 400)
+        self.assertIn(b'is not a valid choice.', messages[1]['body'])
+
+    def test_export_under_asgi_goes_through_the_middleware(self):
+        messages = self.request('ddds=[21]')
+
+        self.assertIn((b'X-Content-Type-Options', b'nosniff'), messages[0]['headers'])
+
+    def test_export_under_asgi_checks_the_host(self):
+        messages = self.request('ddds=[21]', headers=[(b'host', b'evil.example.com')])
+
+        self.assertEqual(messages[0]['status'], 400)
+
+    def test_export_under_asgi_handles_view_errors(self):
+        with mock.patch.object(helpers, 'build_lookups', side_effect=DatabaseError('boom')):
+            messages = self.request('ddds=[21]')
+
+        self.assertEqual(messages[0]['status'], 500)
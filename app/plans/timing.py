@@ -0,0 +1,64 @@
+import contextlib
+import time
+from contextvars import ContextVar
+
+_current = ContextVar('plans_timings', default=None)
+
+
+class Timings:
+    def __init__(self):
+        self.queries = 0
+        self.durations = {'db': 0.0, 'fetch': 0.0, 'serialize': 0.0, 'view': 0.0}
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by record() for the queries of the request being timed.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.durations['db'] += time.perf_counter() - start
+
+    def as_dict(self):
+        timings = {'%s_ms' % name: round(duration * 1000, 3)
+                   for name, duration in self.durations.items()}
+        timings['queries'] = self.queries
+        return timings
+
+
+def record(execute, sql, params, many, context):
+    # Installed on every connection, so the queries of a timed request are
+    # counted in whichever thread runs them, sync views under ASGI included.
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    return timings(execute, sql, params, many, context)
+
+def install(sender, connection, **kwargs):
+    # connection_created fires again on reconnects of the same wrapper.
+    if record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record)
+
+def current():
+    return _current.get()
+
+def start():
+    timings = Timings()
+    return timings, _current.set(timings)
+
+def stop(token):
+    _current.reset(token)
+
+@contextlib.contextmanager
+def measure(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.durations[name] += time.perf_counter() - start
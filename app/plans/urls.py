@@ -1,10 +1,24 @@
+from django.conf import settings
 from django.urls import path
 
+from . import async_services
 from . import services
 
+views = async_services if settings.PLANS_ASYNC_VIEWS else services
+
 urlpatterns = [
-    path('create/', services.create, name='create'),
-    path('update/<int:plan_id>', services.update, name='update'),
-    path('delete/<int:plan_id>', services.delete, name='delete'),
-    path('', services.list, name='list'),
+    path('create/', views.create, name='create'),
+    path('bulk/', services.bulk_create, name='bulk_create'),
+    path('bulk-update/', services.bulk_update, name='bulk_update'),
+    path('bulk-delete/', services.bulk_delete, name='bulk_delete'),
+    path('update/<int:plan_id>', views.update, name='update'),
+    path('delete/<int:plan_id>', views.delete, name='delete'),
+    path('by-code/<str:plan_code>', services.upsert, name='upsert'),
+    path('export', services.export, name='export'),
+    path('changes', services.changes, name='changes'),
+    path('batch', services.batch, name='batch'),
+    path('cheapest/', services.cheapest, name='cheapest'),
+    path('stats/', services.plan_stats, name='plan_stats'),
+    path('cache/stats', services.cache_stats, name='cache_stats'),
+    path('', views.list, name='list'),
 ]
@@ -0,0 +1,147 @@
+from decimal import Decimal, InvalidOperation
+
+INTEGER_MAX = 2 ** 31 - 1
+
+
+class PayloadValidator:
+    # Built once from plans/lists.py: the choices become frozensets, so each
+    # DDD and plan type check is a hash lookup instead of a list scan, and
+    # well-typed numbers are accepted without going through int()/float().
+    # The column limits are checked too, so a row the database would
+    # reject is reported with its fields instead of failing the request.
+    # Each field has a single check, which returns the error message or None.
+    def __init__(self, ddds, plan_types, required_fields, max_lengths=None, price_digits=(6, 2)):
+        self.ddds = frozenset(ddds)
+        self.plan_types = frozenset(plan_types)
+        self.required_fields = tuple(required_fields)
+        self.required = frozenset(required_fields)
+        self.max_price = 10 ** (price_digits[0] - price_digits[1])
+        self.max_price_exponent = price_digits[0] - price_digits[1]
+        self.price_step = Decimal(1).scaleb(-price_digits[1])
+        # Prices inside this bound can't round up to max_price, even with the
+        # float error, so they skip the Decimal rounding.
+        self.price_bound = self.max_price - float(self.price_step)
+        self.price_message = 'must be lower than %s.' % self.max_price
+        self.checks = {
+            'minutes': self.check_minutes,
+            'price': self.check_price,
+            'plan_type': self.check_plan_type,
+            'ddds': self.check_ddds,
+        }
+
+        for field, max_length in (max_lengths or {}).items():
+            self.checks[field] = self.text_check(max_length)
+
+    def check_minutes(self, value):
+        if type(value) is not int:
+            try:
+                value = int(value)
+            except (TypeError, ValueError, OverflowError):
+                return 'is not a valid number.'
+
+        if -INTEGER_MAX - 1 <= value <= INTEGER_MAX:
+            return None
+
+        return 'is out of range.'
+
+    def check_price(self, value):
+        number = value
+        if type(number) is not float and type(number) is not int:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return 'is not a valid number.'
+
+        if -self.price_bound < number < self.price_bound:
+            return None
+
+        return None if self.fits_price(value) else self.price_message
+
+    def fits_price(self, value):
+        try:
+            price = Decimal(str(value))
+        except InvalidOperation:
+            return False
+
+        # Quantizing a price with a large exponent overflows the decimal
+        # context, so those are rejected before rounding.
+        if not price.is_finite() or price.adjusted() >= self.max_price_exponent:
+            return False
+
+        return abs(price.quantize(self.price_step)) < self.max_price
+
+    def text_check(self, max_length):
+        message = 'must be a text of at most %d characters.' % max_length
+
+        def check_text(value):
+            if type(value) is str and len(value) <= max_length:
+                return None
+
+            return message
+
+        return check_text
+
+    def check_plan_type(self, value):
+        if type(value) is str and value in self.plan_types:
+            return None
+
+        return 'is not a valid choice.'
+
+    def check_ddds(self, value):
+        return None if self.is_ddds(value) else 'is not a valid choice.'
+
+    def is_ddds(self, value):
+        if not isinstance(value, list):
+            return False
+
+        try:
+            return self.ddds.issuperset(value)
+        except TypeError:
+            return False
+
+    def validate(self, payload, partial=False):
+        # A full payload only reports empty fields when it has any; a partial
+        # one, sent to update, checks each field it carries.
+        invalid_fields = [{key: 'is empty.'} for key, value in payload.items() if not value]
+
+        if invalid_fields and not partial:
+            return invalid_fields
+
+        checks = self.checks
+        for key in (payload if partial else checks):
+            check = checks.get(key)
+            value = payload[key]
+            if check is None or not value:
+                continue
+
+            message = check(value)
+            if message is not None:
+                invalid_fields.append({key: message})
+
+        return invalid_fields
+
+    def validate_required(self, payload):
+        if self.required.issubset(payload):
+            return []
+
+        return [{key: 'is required.'} for key in self.required_fields if key not in payload]
+
+    def validate_batch(self, payloads, partial=False):
+        errors = {}
+        validate = self.validate
+        validate_required = self.validate_required
+
+        for index, payload in enumerate(payloads):
+            if not isinstance(payload, dict):
+                errors[index] = [{'row': 'is not an object.'}]
+                continue
+
+            if partial:
+                invalid_fields = validate(payload, partial=True)
+            else:
+                invalid_fields = validate_required(payload) or validate(payload)
+
+            if invalid_fields:
+                errors[index] = invalid_fields
+
+        return errors
@@ -4,7 +4,7 @@ ASGI config for wooza project.
 It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
 import os
@@ -12,5 +12,24 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wooza.settings')
+os.environ.setdefault('PLANS_ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from plans import events, exports  # noqa: E402, needs the apps loaded by get_asgi_application
+
+export_application = exports.ExportHandler()
+
+
+async def application(scope, receive, send):
+    # Server-Sent Events are streamed outside Django, so a subscriber holds
+    # no thread or database connection while it waits for changes.
+    if scope['type'] == 'http' and scope['path'] == events.EVENTS_PATH:
+        return await events.stream(scope, receive, send)
+
+    # The export's rows are read chunk by chunk in a worker thread, which
+    # Django 3.1 doesn't do for streaming responses.
+    if scope['type'] == 'http' and scope['path'] == exports.EXPORT_PATH:
+        return await export_application(scope, receive, send)
+
+    return await django_application(scope, receive, send)
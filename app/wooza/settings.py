@@ -26,9 +26,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 MIDDLEWARE = [
+    'plans.middleware.server_timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +75,46 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'wooza',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
+    }
+}
+
+PLANS_LIST_CACHE_TIMEOUT = 300
+
+# Serve create, update, delete and list from plans.async_services. Enabled by
+# wooza/asgi.py, since async views only pay off under an ASGI server.
+PLANS_ASYNC_VIEWS = os.environ.get('PLANS_ASYNC_VIEWS') == '1'
+
+# Callable used to encode the plans API responses. Any dumps returning str or
+# bytes works, e.g. 'orjson.dumps' when orjson is installed.
+PLANS_JSON_DUMPS = 'json.dumps'
+
+# Share of plans requests timed by plans.middleware.server_timing_middleware.
+PLANS_TIMING_SAMPLE_RATE = 0.1
+
+# Seconds between the first write and the refresh of the plans_stats view
+# behind /plans/stats/. 0 refreshes on every commit and None never does.
+PLANS_STATS_REFRESH_DELAY = 5
+
+# How the list query matches DDDs: 'array' uses the GIN index on ddds and
+# 'bitset' the ddds_low/ddds_high masks (see benchmarks/ddds.py).
+PLANS_DDDS_LOOKUP = 'array'
+
+# Events kept for a /plans/events client that is slower than the changes
+# before it is disconnected, and seconds between keep-alive comments.
+PLANS_EVENTS_BUFFER_SIZE = 100
+PLANS_EVENTS_HEARTBEAT = 15
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 